@@ -1,15 +1,23 @@
 import os
+import re
 import sys
+import json
+import uuid
 import datetime
 import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 from typing import Dict, List, Tuple
 from plyer import notification
 
 from PyQt6 import uic
-from PyQt6.QtCore import Qt, QDate, QTime, QTimer, QThread, pyqtSignal, QObject
+from PyQt6.QtCore import Qt, QDate, QTime, QTimer, pyqtSignal, QObject
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QMessageBox, QTreeWidgetItem, QMenu, QTreeWidget, QInputDialog, QColorDialog,
     QSystemTrayIcon, QStyle
@@ -27,41 +35,162 @@ TASK_CATEGORIES = [
     'Не срочно и не важно'
 ]
 
+OUTBOX_BATCH_SIZE = 500  # как MAX_BATCH_SIZE на сервере
+OUTBOX_MAX_DELAY = 300  # секунд между повторами отправки при недоступном сервере
+# Коды, с которыми сервер отвергает саму пачку; остальные 4xx (токен, лимиты) повторяем как сбой сети
+OUTBOX_RETRY_STATUSES = (401, 403, 408, 429)
+NETWORK_WORKERS = 4  # одновременных запросов к серверу
+NETWORK_TIMEOUT = (5, 30)  # секунд на подключение и на ответ
+
+# Строки локальной БД в памяти и в элементах списков; id — первичный ключ локальной таблицы
+EventItem = namedtuple('EventItem', 'id server_id name date_end start end is_completed')
+TaskItem = namedtuple('TaskItem', 'id server_id name description is_completed')
+
 
 # ===================================================================
 # БЛОК 1: СЕТЕВАЯ ИНФРАСТРУКТУРА (МНОГОПОТОЧНОСТЬ)
 # ===================================================================
 
-class NetworkWorker(QObject):
-    finished = pyqtSignal(object)  # Сигнал успеха с данными
-    error = pyqtSignal(str)  # Сигнал ошибки с текстом
+class NetworkService(QObject):
+    """Все запросы клиента: одна сессия с keep-alive и ограниченный пул потоков.
 
-    def __init__(self, url: str, method="POST", payload: dict = None, token: str = None):
-        super().__init__()
-        self.url = url
-        self.method = method
-        self.payload = payload
-        self.headers = {'Authorization': f'Bearer {token}'} if token else {}
+    Одинаковый запрос, пока предыдущий ещё выполняется, не отправляется повторно — его колбэки
+    дописываются к уже идущему. Колбэки вызываются в основном потоке через сигнал.
+    """
+    _done = pyqtSignal(object, object)  # ключ запроса, Future
 
-    def run(self):
+    def __init__(self, workers: int = NETWORK_WORKERS, timeout=NETWORK_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='net')
+        self._inflight = {}  # ключ -> [Future, колбэки успеха, колбэки ошибки]
+        # Всегда через очередь событий: колбэк не вызывается изнутри request()
+        self._done.connect(self._deliver, Qt.ConnectionType.QueuedConnection)
+
+    def request(self, method: str, url: str, payload: dict = None, token: str = None,
+                on_success=None, on_error=None):
+        """Ставит запрос в пул и возвращает его ключ для cancel().
+
+        on_success(data) получает разобранный JSON, on_error(err, status) — текст ошибки и HTTP-код (None без ответа).
+        """
+        key = (method, url, json.dumps(payload, sort_keys=True), token)
+        entry = self._inflight.get(key)
+        is_new = entry is None
+        if is_new:
+            entry = self._inflight[key] = [None, [], []]
+        # Повторное нажатие с тем же слотом не вызывает его дважды
+        for callbacks, callback in ((entry[1], on_success), (entry[2], on_error)):
+            if callback is not None and callback not in callbacks:
+                callbacks.append(callback)
+        if is_new:
+            # Колбэки уже в записи: ответ может прийти раньше, чем мы выйдем отсюда
+            headers = {'Authorization': f'Bearer {token}'} if token else {}
+            future = entry[0] = self.executor.submit(self._send, method, url, payload, headers)
+            future.add_done_callback(lambda f: self._done.emit(key, f))
+        return key
+
+    def _send(self, method, url, payload, headers):
+        resp = self.session.request(method, url, json=payload, headers=headers, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json() if resp.content else {}
+
+    def _deliver(self, key, future):
+        entry = self._inflight.get(key)
+        if entry is None or entry[0] is not future:
+            return  # запрос отменён, ответ никому не нужен
+        del self._inflight[key]
         try:
-            if self.method == "POST":
-                resp = requests.post(self.url, json=self.payload, headers=self.headers)
-            elif self.method == "DELETE":
-                resp = requests.delete(self.url, headers=self.headers)
-            elif self.method == "PATCH":
-                resp = requests.patch(self.url, json=self.payload, headers=self.headers)
-            elif self.method == "GET":
-                resp = requests.get(self.url, headers=self.headers)
-
-            resp.raise_for_status()
-            data = resp.json() if resp.content else {}
-            self.finished.emit(data)
-
+            data = future.result()
         except requests.exceptions.RequestException as e:
-            self.error.emit(f"Ошибка сети: {str(e)}")
+            status = e.response.status_code if e.response is not None else None
+            self._fail(entry[2], f"Ошибка сети: {str(e)}", status)
         except Exception as e:
-            self.error.emit(f"Ошибка: {str(e)}")
+            self._fail(entry[2], f"Ошибка: {str(e)}", None)
+        else:
+            for callback in entry[1]:
+                callback(data)
+
+    @staticmethod
+    def _fail(callbacks, err, status):
+        if not callbacks:
+            print(err)
+        for callback in callbacks:
+            callback(err, status)
+
+    def cancel(self, key):
+        """Забывает запрос: колбэки не вызовутся, а ещё не начатый запрос не уйдёт на сервер."""
+        entry = self._inflight.pop(key, None)
+        if entry is not None:
+            entry[0].cancel()
+
+    def shutdown(self):
+        for key in list(self._inflight):
+            self.cancel(key)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+# ===================================================================
+# БЛОК 1.1: ЛОКАЛЬНОЕ ХРАНИЛИЩЕ (SQLite)
+# ===================================================================
+
+class LocalStore:
+    """Одно соединение с локальной БД на всё время работы приложения.
+
+    Раньше каждый запрос открывал и закрывал соединение и платил полный fsync за коммит.
+    Здесь журнал WAL с synchronous=NORMAL, а подготовленные запросы переиспользуются
+    из кэша выражений sqlite3. Пачку изменений можно обернуть в transaction(): внутри
+    commit=True не коммитит, всё фиксируется одним коммитом в конце.
+    Запросы могут приходить и из потоков сети, поэтому доступ к соединению под блокировкой.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+        self.lock = threading.RLock()
+        self._depth = 0
+        for pragma in ('journal_mode = WAL', 'synchronous = NORMAL', 'cache_size = -8000',  # 8 МБ
+                       'temp_store = MEMORY', 'busy_timeout = 5000'):
+            self.conn.execute(f'PRAGMA {pragma}')
+
+    def execute(self, query: str, params: Tuple = (), commit: bool = False) -> sqlite3.Cursor:
+        with self.lock:
+            cursor = self.conn.execute(query, params)
+            if commit and not self._depth:
+                self.conn.commit()
+            return cursor
+
+    def executemany(self, query: str, rows, commit: bool = False) -> sqlite3.Cursor:
+        with self.lock:
+            cursor = self.conn.executemany(query, rows)
+            if commit and not self._depth:
+                self.conn.commit()
+            return cursor
+
+    @contextmanager
+    def transaction(self):
+        """Все запросы внутри фиксируются одним коммитом или откатываются при ошибке; вложенные блоки — часть внешнего."""
+        with self.lock:
+            self._depth += 1
+            try:
+                yield self
+            except Exception:
+                if self._depth == 1:
+                    self.conn.rollback()
+                raise
+            else:
+                if self._depth == 1:
+                    self.conn.commit()
+            finally:
+                self._depth -= 1
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
 
 
 # ===================================================================
@@ -91,10 +220,16 @@ class SimplePlanner(QMainWindow):
         self.past_color = QColor('#FF9F7C')
         self.current_date = 1
         self.current_importance = TASK_CATEGORIES[0]
+        self._outbox_inflight = None
+        self._outbox_delay = 5
+        self._outbox_limit = OUTBOX_BATCH_SIZE
         self.global_font = QFont('Segoe UI', 8)
 
         # --- Настройка системы ---
         self._init_db()
+        self.net = NetworkService()
+        QApplication.instance().aboutToQuit.connect(self.net.shutdown)
+        QApplication.instance().aboutToQuit.connect(self.db.close)
         self.load_data()
         self.sync_all()
         self._setup_tree_widgets()
@@ -133,14 +268,8 @@ class SimplePlanner(QMainWindow):
     # БЛОК 3: РАБОТА С БАЗОЙ ДАННЫХ
     # -------------------------------------------------------------------
     def _execute_query(self, query: str, params: Tuple = (), commit: bool = False, fetch_all: bool = False):
-        conn = None
         try:
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-
-            if commit:
-                conn.commit()
+            cursor = self.db.execute(query, params, commit=commit)
 
             if fetch_all:
                 return cursor.fetchall()
@@ -150,20 +279,15 @@ class SimplePlanner(QMainWindow):
         except sqlite3.Error as e:
             print(f"Ошибка БД: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
 
     def _init_db(self):
-        conn = None
         try:
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
+            self.db = LocalStore(DB_FILE)
 
             queries = [
                 '''
                 CREATE TABLE IF NOT EXISTS events (
-                    id INTEGER PRIMARY KEY,
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
                     name TEXT NOT NULL,
                     start_date TEXT NOT NULL,
                     end_date TEXT NOT NULL,
@@ -175,7 +299,7 @@ class SimplePlanner(QMainWindow):
                 ''',
                 '''
                 CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY,
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
                     name TEXT NOT NULL,
                     description TEXT,
                     category TEXT NOT NULL,
@@ -192,19 +316,74 @@ class SimplePlanner(QMainWindow):
                     font TEXT DEFAULT 'Segoe UI',
                     color TEXT DEFAULT '#FF7F50'
                 )
+                ''',
+                '''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    entity TEXT PRIMARY KEY,
+                    cursor INTEGER NOT NULL DEFAULT 0
+                )
+                ''',
+                # Уникальный server_id нужен для upsert при синхронизации; старые дубли убираем,
+                # оставляя самую раннюю локальную копию
                 '''
+                DELETE FROM events WHERE server_id IS NOT NULL AND id NOT IN (
+                    SELECT MIN(id) FROM events WHERE server_id IS NOT NULL GROUP BY server_id
+                )
+                ''',
+                'CREATE UNIQUE INDEX IF NOT EXISTS ux_events_server_id ON events (server_id)',
+                '''
+                DELETE FROM tasks WHERE server_id IS NOT NULL AND id NOT IN (
+                    SELECT MIN(id) FROM tasks WHERE server_id IS NOT NULL GROUP BY server_id
+                )
+                ''',
+                'CREATE UNIQUE INDEX IF NOT EXISTS ux_tasks_server_id ON tasks (server_id)',
+                'CREATE INDEX IF NOT EXISTS ix_events_start_date ON events (start_date, time_start)',
+                # Очередь изменений для сервера: не больше одной операции на строку, seq растёт при каждом слиянии.
+                # client_id создания — ключ, по которому сервер узнаёт повтор пачки после потерянного ответа;
+                # op = 'rejected' — создание, которое сервер отверг, чтобы оно не вставало в очередь снова
+                '''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entity TEXT NOT NULL,
+                    local_id INTEGER NOT NULL,
+                    op TEXT NOT NULL,
+                    server_id INTEGER NULL,
+                    payload TEXT NOT NULL DEFAULT '{}',
+                    seq INTEGER NOT NULL DEFAULT 0,
+                    client_id TEXT NULL
+                )
+                ''',
+                "UPDATE outbox SET client_id = lower(hex(randomblob(16))) WHERE op = 'create' AND client_id IS NULL",
+                'CREATE UNIQUE INDEX IF NOT EXISTS ux_outbox_row ON outbox (entity, local_id)'
             ]
-            for query in queries:
-                cursor.execute(query)
-
-            conn.commit()
+            with self.db.transaction():
+                outbox_sql = self._table_sql('outbox')
+                if outbox_sql and 'client_id' not in outbox_sql:
+                    self.db.execute('ALTER TABLE outbox ADD COLUMN client_id TEXT NULL')
+                # id удалённой строки не должен достаться новой: по нему очередь узнаёт строку после ответа сервера
+                for table in ('events', 'tasks', 'outbox'):
+                    self._use_autoincrement(table)
+                for query in queries:
+                    self.db.execute(query)
 
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Ошибка БД", f"Не удалось инициализировать базу данных: {e}")
             sys.exit(1)
-        finally:
-            if conn:
-                conn.close()
+
+    def _table_sql(self, table: str) -> str | None:
+        res = self.db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        return res[0] if res else None
+
+    def _use_autoincrement(self, table: str):
+        """Пересоздаёт таблицу из старой базы с id AUTOINCREMENT, сохраняя строки и их id."""
+        sql = self._table_sql(table)
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return
+        self.db.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+        self.db.execute(re.sub(r'\bid INTEGER PRIMARY KEY\b', 'id INTEGER PRIMARY KEY AUTOINCREMENT', sql, count=1))
+        self.db.execute(f"INSERT INTO {table} SELECT * FROM {table}_old")
+        # Индексы уходят вместе со старой таблицей и создаются заново запросами _init_db
+        self.db.execute(f"DROP TABLE {table}_old")
 
     def load_data(self):
         self.events.clear()
@@ -213,11 +392,12 @@ class SimplePlanner(QMainWindow):
 
         # Загрузка событий
         event_rows = self._execute_query(
-            "SELECT name, start_date, end_date, time_start, time_end, is_completed FROM events ORDER BY start_date, time_start",
+            "SELECT id, server_id, name, start_date, end_date, time_start, time_end, is_completed FROM events "
+            "ORDER BY start_date, time_start",
             fetch_all=True
         )
         if event_rows:
-            for name, start_date, end_date, time_start, time_end, is_completed in event_rows:
+            for local_id, server_id, name, start_date, end_date, time_start, time_end, is_completed in event_rows:
                 try:
                     date_start_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
                     date_end_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
@@ -225,16 +405,18 @@ class SimplePlanner(QMainWindow):
                     time_end_obj = datetime.strptime(time_end, "%H:%M").time()
                     if date_start_obj not in self.events:
                         self.events[date_start_obj] = []
-                    self.events[date_start_obj].append((name, date_end_obj, time_start_obj, time_end_obj, is_completed))
+                    self.events[date_start_obj].append(EventItem(local_id, server_id, name, date_end_obj,
+                                                                 time_start_obj, time_end_obj, is_completed))
                 except ValueError:
                     print("Ошибка парсинга даты/времени")
 
         # Загрузка задач
-        task_rows = self._execute_query("SELECT name, description, category, is_completed FROM tasks", fetch_all=True)
+        task_rows = self._execute_query("SELECT id, server_id, name, description, category, is_completed FROM tasks",
+                                        fetch_all=True)
         if task_rows:
-            for name, desc, cat, is_completed in task_rows:
+            for local_id, server_id, name, desc, cat, is_completed in task_rows:
                 if cat in self.tasks:
-                    self.tasks[cat].append((name, desc, is_completed))
+                    self.tasks[cat].append(TaskItem(local_id, server_id, name, desc, is_completed))
 
         # Загрузка настроек
         settings_res = self._execute_query('SELECT tg_enabled, font_size, font, color FROM settings WHERE id = 1',
@@ -276,14 +458,14 @@ class SimplePlanner(QMainWindow):
 
         if tree_widget is self.eventList and item.parent():
             ev_data = item.data(0, Qt.ItemDataRole.UserRole)
-            is_completed = ev_data[4]
+            is_completed = ev_data.is_completed
             text = "Отменить выполнение" if is_completed else "Выполнить"
             action_toggle_done = menu.addAction(text)
             menu.addSeparator()
 
         if tree_widget is self.taskList and item.parent():
             task_data = item.data(0, Qt.ItemDataRole.UserRole)
-            is_completed = task_data[2]
+            is_completed = task_data.is_completed
             text = "Отменить выполнение" if is_completed else "Выполнить"
             action_toggle_done = menu.addAction(text)
             menu.addSeparator()
@@ -334,7 +516,7 @@ class SimplePlanner(QMainWindow):
 
             self._delete_event_logic(item)
 
-            name, end_date, start, end, _ = event_data
+            name, end_date, start, end = event_data.name, event_data.date_end, event_data.start, event_data.end
             self.eventName.setText(name)
             self.timeStart.setTime(QTime(start.hour, start.minute))
             self.timeEnd.setTime(QTime(end.hour, end.minute))
@@ -348,7 +530,7 @@ class SimplePlanner(QMainWindow):
 
             self._delete_task_logic(item)
 
-            name, desc, _ = task_data
+            name, desc = task_data.name, task_data.description
             self.taskName.setText(name)
             self.taskDes.setText(desc)
             self.current_importance = category_name
@@ -373,35 +555,188 @@ class SimplePlanner(QMainWindow):
         self._execute_query("UPDATE settings SET tg_enabled = 1 WHERE id = 1", commit=True)
         self.tg_enabled = True
 
-    def _run_worker(self, url, payload, on_success):
-        """Вспомогательный метод для запуска потока"""
-        self.thread = QThread()
-        self.worker = NetworkWorker(url, payload=payload)
-        self.worker.moveToThread(self.thread)
+    def _get_sync_cursor(self, entity: str) -> int:
+        res = self._execute_query("SELECT cursor FROM sync_state WHERE entity = ?", (entity,), fetch_all=True)
+        return res[0][0] if res else 0
+
+    def _save_sync_cursor(self, entity: str, cursor: int):
+        query = "INSERT OR REPLACE INTO sync_state (entity, cursor) VALUES (?, ?)"
+        self._execute_query(query, (entity, cursor), commit=True)
+
+    def _get_server_id(self, table: str, local_id: int) -> int | None:
+        # server_id приходит асинхронно после отправки, поэтому читаем его по первичному ключу, а не из списка
+        res = self._execute_query(f"SELECT server_id FROM {table} WHERE id = ?", (local_id,), fetch_all=True)
+        return res[0][0] if res else None
+
+    # --- Очередь изменений (outbox) ---
+    # Каждое изменение сначала записывается в outbox и только потом отправляется пачкой
+    # через /events:batch и /tasks:batch, поэтому изменения без сети не теряются.
+
+    def _outbox_record(self, entity: str, local_id: int, op: str, payload: dict = None, server_id: int = None):
+        """Добавляет изменение строки в очередь, сливая его с уже ожидающим изменением той же строки."""
+        with self.db.transaction():
+            res = self._execute_query("SELECT id, op, server_id, payload FROM outbox WHERE entity = ? AND local_id = ?",
+                                      (entity, local_id), fetch_all=True)
+            pending = res[0] if res else None
+
+            if op == 'create':
+                self._execute_query("INSERT OR REPLACE INTO outbox (entity, local_id, op, payload, client_id) "
+                                    "VALUES (?, ?, ?, ?, ?)", (entity, local_id, op, json.dumps(payload),
+                                                               uuid.uuid4().hex), commit=True)
+            elif op == 'update':
+                if pending and pending[1] in ('create', 'update'):
+                    merged = {**json.loads(pending[3]), **payload}
+                    self._execute_query("UPDATE outbox SET payload = ?, seq = seq + 1 WHERE id = ?",
+                                        (json.dumps(merged), pending[0]), commit=True)
+                elif not pending and server_id:
+                    self._execute_query("INSERT INTO outbox (entity, local_id, op, server_id, payload) "
+                                        "VALUES (?, ?, ?, ?, ?)", (entity, local_id, op, server_id, json.dumps(payload)),
+                                        commit=True)
+            elif op == 'delete':
+                if pending and pending[1] in ('create', 'rejected'):
+                    # Сервер о строке не знает: создание и удаление взаимно уничтожаются
+                    self._execute_query("DELETE FROM outbox WHERE id = ?", (pending[0],), commit=True)
+                elif pending:
+                    self._execute_query("UPDATE outbox SET op = 'delete', payload = '{}', server_id = ?, seq = seq + 1 "
+                                        "WHERE id = ?", (server_id or pending[2], pending[0]), commit=True)
+                elif server_id:
+                    self._execute_query("INSERT INTO outbox (entity, local_id, op, server_id) VALUES (?, ?, ?, ?)",
+                                        (entity, local_id, op, server_id), commit=True)
+
+    @staticmethod
+    def _event_payload(name, start_date, end_date, time_start, time_end, is_completed) -> dict:
+        """Данные создания события на сервере из полей локальной строки (даты ГГГГ-ММ-ДД, время ЧЧ:ММ)."""
+        return {
+            'event_name': name,
+            'start_date': start_date,
+            'end_date': end_date,
+            'time_start': time_start,
+            'time_end': time_end,
+            'is_completed': is_completed,
+            'notify_at': f"{start_date} {time_start}"
+        }
+
+    def _queue_unsent(self):
+        """Ставит в очередь создания строк, которых нет ни на сервере, ни в очереди.
+
+        Это записи, сделанные до связывания с Telegram, и записи, отправка которых не удалась до появления очереди.
+        """
+        with self.db.transaction():
+            events = self._execute_query(
+                "SELECT id, name, start_date, end_date, time_start, time_end, is_completed FROM events "
+                "WHERE server_id IS NULL AND id NOT IN (SELECT local_id FROM outbox WHERE entity = 'events')",
+                fetch_all=True) or []
+            for local_id, *fields in events:
+                self._outbox_record('events', local_id, 'create', self._event_payload(*fields))
+            tasks = self._execute_query(
+                "SELECT id, name, description, category, is_completed FROM tasks "
+                "WHERE server_id IS NULL AND id NOT IN (SELECT local_id FROM outbox WHERE entity = 'tasks')",
+                fetch_all=True) or []
+            for local_id, name, desc, category, is_completed in tasks:
+                self._outbox_record('tasks', local_id, 'create', {'name': name, 'description': desc,
+                                                                   'category': category, 'is_completed': is_completed})
+
+    def flush_outbox(self):
+        """Отправляет до OUTBOX_BATCH_SIZE ожидающих изменений одной сущности одним запросом."""
+        token = self._get_api_token()
+        if self._outbox_inflight or not token:
+            return
+        res = self._execute_query("SELECT entity FROM outbox WHERE op != 'rejected' ORDER BY id LIMIT 1",
+                                  fetch_all=True)
+        if not res:
+            return
+        entity = res[0][0]
+        rows = self._execute_query("SELECT id, local_id, op, server_id, payload, seq, client_id FROM outbox "
+                                   "WHERE entity = ? AND op != 'rejected' ORDER BY id LIMIT ?",
+                                   (entity, self._outbox_limit), fetch_all=True)
+        operations = []
+        for _, _, op, server_id, payload, _, client_id in rows:
+            if op == 'create':
+                operations.append({'op': 'create', 'client_id': client_id, 'data': json.loads(payload)})
+            elif op == 'update':
+                operations.append({'op': 'update', 'id': server_id, 'patch': json.loads(payload)})
+            else:
+                operations.append({'op': 'delete', 'id': server_id})
+
+        self._outbox_inflight = (entity, rows)
+        self.net.request('POST', f"{SERVER_URL}/{entity}:batch", {'operations': operations}, token,
+                         on_success=self._on_outbox_sent, on_error=self._on_outbox_failed)
+
+    def _on_outbox_sent(self, response):
+        entity, rows = self._outbox_inflight
+        created = False
+        with self.db.transaction():
+            for result in response.get('results', []):
+                outbox_id, local_id, op, _, _, seq, client_id = rows[result['index']]
+                if result['status'] != 'created':
+                    # Строка удаляется из очереди, только если её не изменили, пока шла отправка
+                    self._execute_query("DELETE FROM outbox WHERE id = ? AND seq = ?", (outbox_id, seq), commit=True)
+                    continue
+
+                created = True
+                server_id = result['id']
+                # Сначала смотрим, что стало с записью очереди, пока шло создание, и только потом трогаем строку
+                res = self._execute_query("SELECT seq, payload FROM outbox WHERE id = ? AND client_id = ?",
+                                          (outbox_id, client_id), fetch_all=True)
+                # Синхронизация могла уже скачать эту строку отдельной копией
+                self._execute_query(f"DELETE FROM {entity} WHERE server_id = ? AND id != ?", (server_id, local_id),
+                                    commit=True)
+                if not res:
+                    # Удалили, пока шло создание: теперь удаляем и на сервере
+                    self._outbox_record(entity, local_id, 'delete', server_id=server_id)
+                    continue
 
-        self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(on_success)
-        self.worker.error.connect(lambda err: QMessageBox.warning(self, "Ошибка сети", err))
+                self._execute_query(f"UPDATE {entity} SET server_id = ? WHERE id = ?", (server_id, local_id),
+                                    commit=True)
+                if res[0][0] != seq:
+                    # Изменили, пока шло создание: досылаем статус отдельным обновлением
+                    patch = {'is_completed': json.loads(res[0][1]).get('is_completed', 0)}
+                    self._execute_query("UPDATE outbox SET op = 'update', server_id = ?, payload = ?, client_id = NULL "
+                                        "WHERE id = ?", (server_id, json.dumps(patch), outbox_id), commit=True)
+                else:
+                    self._execute_query("DELETE FROM outbox WHERE id = ?", (outbox_id,), commit=True)
 
-        # Очистка
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
+        self._outbox_inflight = None
+        self._outbox_delay = 5
+        self._outbox_limit = OUTBOX_BATCH_SIZE
+        if created:
+            self.load_data()
+        if self._execute_query("SELECT 1 FROM outbox WHERE op != 'rejected' LIMIT 1", fetch_all=True):
+            QTimer.singleShot(0, self.flush_outbox)
+
+    def _on_outbox_failed(self, err, status):
+        entity, rows = self._outbox_inflight
+        self._outbox_inflight = None
+        if status is not None and 400 <= status < 500 and status not in OUTBOX_RETRY_STATUSES:
+            # Сервер отверг пачку целиком: делим её пополам, пока не останется одна отвергнутая операция,
+            # и откладываем только её, чтобы она не держала остальную очередь
+            if len(rows) > 1:
+                self._outbox_limit = max(1, len(rows) // 2)
+            else:
+                outbox_id, local_id, op, _, _, seq, _ = rows[0]
+                print(f"{err}. Сервер отверг изменение {entity} #{local_id} ({op})")
+                if op == 'create':
+                    self._execute_query("UPDATE outbox SET op = 'rejected' WHERE id = ? AND seq = ?", (outbox_id, seq),
+                                        commit=True)
+                else:
+                    self._execute_query("DELETE FROM outbox WHERE id = ? AND seq = ?", (outbox_id, seq), commit=True)
+            QTimer.singleShot(0, self.flush_outbox)
+            return
 
-        self.thread.start()
+        # Сервер недоступен: изменения остаются в очереди, повтор с растущей паузой
+        print(f"{err}. Повтор отправки через {self._outbox_delay} с")
+        QTimer.singleShot(self._outbox_delay * 1000, self.flush_outbox)
+        self._outbox_delay = min(self._outbox_delay * 2, OUTBOX_MAX_DELAY)
 
     def open_telegram_dialog(self):
         code, ok = QInputDialog.getText(self, "Связывание Telegram",
-                                        "Напишите боту(@MaxPal_bot) '/start' и введите код, полученный  от него. Предыдущие записи не будут привязаны(используйте редактировать чтобы пересоздать)")
+                                        "Напишите боту(@MaxPal_bot) '/start' и введите код, полученный  от него. Записи, сделанные до связывания, тоже будут отправлены")
         if ok and code:
             self.tgButton.setEnabled(False)
             self.tgButton.setText("Загрузка...")
 
-            self._run_worker(
-                url=f"{SERVER_URL}/auth/link",
-                payload={"code": str(code)},
-                on_success=self._on_link_success
-            )
+            self.net.request('POST', f"{SERVER_URL}/auth/link", {"code": str(code)},
+                             on_success=self._on_link_success, on_error=self._on_link_failed)
 
     def _on_link_success(self, data):
         """Слот при успешном связывании"""
@@ -410,10 +745,17 @@ class SimplePlanner(QMainWindow):
             self._save_api_token(api_token)
             QMessageBox.information(self, "Успех", "Устройство успешно связано с Telegram!")
             self.tgButton.setText("Telegram (Связан)")
+            # Записи, сделанные до связывания, сразу уходят на сервер
+            self.sync_all()
         else:
             QMessageBox.critical(self, "Ошибка", "Сервер не вернул токен.")
         self.tgButton.setEnabled(True)
 
+    def _on_link_failed(self, err, status):
+        QMessageBox.warning(self, "Ошибка сети", err)
+        self.tgButton.setText("Связать с TG")
+        self.tgButton.setEnabled(True)
+
     # -------------------------------------------------------------------
     # БЛОК 6: ЛОГИКА УВЕДОМЛЕНИЙ (Windows Notifications)
     # -------------------------------------------------------------------
@@ -429,15 +771,9 @@ class SimplePlanner(QMainWindow):
 
         if current_date in self.events.keys():
             for event in self.events[current_date]:
-                print(event)
-                name, date_start, date_end, time_start, time_end, _ = 0, 0, 0, 0, 0, 0
-                if len(event) == 5:
-                    name, date_start, time_start, time_end, _ = event
-                    date_end = date_start
-                else:
-                    name, date_start, date_end, time_start, time_end, _ = event
-                date_start = datetime.combine(date_start, time_start)
-                date_end = datetime.combine(date_end, time_end)
+                name, time_start = event.name, event.start
+                date_start = datetime.combine(current_date, time_start)
+                date_end = datetime.combine(event.date_end, event.end)
                 if time_start.hour == current_time.hour and time_start.minute == current_time.minute:
                     self._send_windows_notification(name, date_start, date_end)
 
@@ -490,37 +826,12 @@ class SimplePlanner(QMainWindow):
             QMessageBox.critical(self, "Ошибка", "Не удалось сохранить событие локально.")
             return
 
-        # 2. Подготовка и отправка на сервер (ЧЕРЕЗ WORKER)
+        # 2. Подготовка и постановка в очередь отправки на сервер
         token = self._get_api_token()
         if token:
-            start_str = datetime.combine(date_start, start_py)
-            notify_at_str = start_str.strftime("%Y-%m-%d %H:%M")
-
-            payload = {
-                'event_name': name,
-                'start_date': date_start.strftime("%Y-%m-%d"),
-                'end_date': date_end.strftime("%Y-%m-%d"),
-                'time_start': start_py.strftime("%H:%M"),
-                'time_end': end_py.strftime("%H:%M"),
-                'is_completed': 0,
-                'notify_at': notify_at_str
-            }
-            print(payload)
-
-            # Создаем поток для отправки события
-            self.event_thread = QThread()
-            self.event_worker = NetworkWorker(f"{SERVER_URL}/events", payload=payload, token=token)
-            self.event_worker.moveToThread(self.event_thread)
-
-            # При успехе обновляем server_id в БД
-            self.event_thread.started.connect(self.event_worker.run)
-            self.event_worker.finished.connect(lambda res: self._on_event_sent(res, local_id))
-
-            # Очистка
-            self.event_worker.finished.connect(self.event_thread.quit)
-            self.event_worker.finished.connect(self.event_worker.deleteLater)
-            self.event_thread.finished.connect(self.event_thread.deleteLater)
-            self.event_thread.start()
+            payload = self._event_payload(name, date_start_str, date_end_str, start_str, end_str, 0)
+            self._outbox_record('events', local_id, 'create', payload)
+            self.flush_outbox()
 
         else:
             QMessageBox.information(self, "Сохранено", "Событие сохранено локально.")
@@ -533,14 +844,6 @@ class SimplePlanner(QMainWindow):
         self.timeEnd.setTime(QTime(0, 0))
         self.load_data()
 
-    def _on_event_sent(self, response, local_id):
-        """Обновляем server_id после успешной отправки"""
-        server_id = response.get('id')
-        if server_id:
-            query = "UPDATE events SET server_id = ? WHERE id = ?"
-            self._execute_query(query, (server_id, local_id), commit=True)
-            print(f"Синхронизировано: local={local_id}, server={server_id}")
-
     def update_event_list(self):
         search = self.searchEvent.text().lower()
         self.eventList.clear()
@@ -562,7 +865,7 @@ class SimplePlanner(QMainWindow):
         # Проходим по всем событиям, чтобы определить статус каждого дня
         for date_key, events_list in self.events.items():
             for ev in events_list:
-                _, date_end_obj, _, _, is_completed = ev
+                date_end_obj, is_completed = ev.date_end, ev.is_completed
                 if is_completed:
                     continue
 
@@ -603,7 +906,7 @@ class SimplePlanner(QMainWindow):
             events_list = self.events[date_key]
 
             if search:
-                matching = [e for e in events_list if search in e[0].lower()]
+                matching = [e for e in events_list if search in e.name.lower()]
             else:
                 matching = events_list
 
@@ -611,8 +914,8 @@ class SimplePlanner(QMainWindow):
                 root_item = QTreeWidgetItem([date_key.strftime("%d.%m.%Y")])
                 root_item.setData(0, Qt.ItemDataRole.UserRole, date_key)
 
-                for ev in sorted(matching, key=lambda x: (x[4], x[2])):
-                    name, date_end, start, end, is_completed = ev
+                for ev in sorted(matching, key=lambda x: (x.is_completed, x.start)):
+                    name, date_end, start, end, is_completed = ev.name, ev.date_end, ev.start, ev.end, ev.is_completed
 
                     # Формирование строки времени
                     if date_key == date_end:
@@ -643,46 +946,18 @@ class SimplePlanner(QMainWindow):
     def _delete_event_logic(self, item):
         if item.parent():
             # --- Удаление конкретного события ---
-            date_key = item.parent().data(0, Qt.ItemDataRole.UserRole)
             ev_data = item.data(0, Qt.ItemDataRole.UserRole)
-            name, date_end, start_time, end_time, _ = ev_data
 
-            date_str = date_key.strftime("%Y-%m-%d")
-            date_end_str = date_end.strftime("%Y-%m-%d")
-            start_str = start_time.strftime("%H:%M")
-            end_str = end_time.strftime("%H:%M")
-
-            # 1. Получаем server_id
-            query_select = '''
-                SELECT server_id FROM events 
-                WHERE name = ? AND start_date = ? AND end_date = ? AND time_start = ? AND time_end = ?
-            '''
-            params_select = (name, date_str, date_end_str, start_str, end_str)
-            result = self._execute_query(query_select, params_select, fetch_all=True)
-            server_id_to_delete = result[0][0] if result and result[0] else None
+            # 1. Получаем server_id (мог прийти с сервера уже после построения списка)
+            server_id_to_delete = self._get_server_id('events', ev_data.id)
 
             # 2. Локальное удаление
-            query_delete = '''
-                DELETE FROM events 
-                WHERE name = ? AND start_date = ? AND end_date = ? AND time_start = ? AND time_end = ?
-            '''
-            self._execute_query(query_delete, params_select, commit=True)
+            self._execute_query("DELETE FROM events WHERE id = ?", (ev_data.id,), commit=True)
 
             # 3. Синхронизация с сервером
-            token = self._get_api_token()
-            if server_id_to_delete and token:
-                self.thread = QThread()
-                self.worker = NetworkWorker(
-                    url=f"{SERVER_URL}/events/{server_id_to_delete}",
-                    method="DELETE",
-                    token=token
-                )
-                self.worker.moveToThread(self.thread)
-                self.thread.started.connect(self.worker.run)
-                self.worker.finished.connect(self.thread.quit)
-                self.worker.finished.connect(self.worker.deleteLater)
-                self.thread.finished.connect(self.thread.deleteLater)
-                self.thread.start()
+            if self._get_api_token():
+                self._outbox_record('events', ev_data.id, 'delete', server_id=server_id_to_delete)
+                self.flush_outbox()
 
             # Обновляем UI (автоматически перерисует календарь)
             self.load_data()
@@ -693,71 +968,31 @@ class SimplePlanner(QMainWindow):
             date_str = date_key.strftime("%Y-%m-%d")
 
             # Получаем ID для удаления с сервера
-            server_id_to = 'SELECT server_id FROM events WHERE start_date = ?'
-            res = self._execute_query(server_id_to, (date_str,), fetch_all=True)
-
-            # Локальное удаление
-            query_delete = "DELETE FROM events WHERE start_date = ?"
-            self._execute_query(query_delete, (date_str,), commit=True)
-
-            token = self._get_api_token()
-            if token and res:
-                ids = [i[0] for i in res if i[0]]
-                if ids:
-                    ids_str = '_'.join(map(str, ids))
-                    self.thread = QThread()
-                    self.worker = NetworkWorker(
-                        url=f"{SERVER_URL}/events/{ids_str}",
-                        method="DELETE",
-                        token=token
-                    )
-                    self.worker.moveToThread(self.thread)
-                    self.thread.started.connect(self.worker.run)
-                    self.worker.finished.connect(self.thread.quit)
-                    self.worker.finished.connect(self.worker.deleteLater)
-                    self.thread.finished.connect(self.thread.deleteLater)
-                    self.thread.start()
+            res = self._execute_query('SELECT id, server_id FROM events WHERE start_date = ?', (date_str,),
+                                      fetch_all=True)
+
+            with self.db.transaction():
+                # Локальное удаление
+                self._execute_query("DELETE FROM events WHERE start_date = ?", (date_str,), commit=True)
+                if self._get_api_token():
+                    for local_id, server_id in res or []:
+                        self._outbox_record('events', local_id, 'delete', server_id=server_id)
+            self.flush_outbox()
 
             # Обновляем UI
             self.load_data()
 
     def _toggle_event_completion(self, item):
-        data_key = item.parent().data(0, Qt.ItemDataRole.UserRole)
         ev_data = item.data(0, Qt.ItemDataRole.UserRole)
-        name, date_end, start_time, end_time, is_completed = ev_data
+        server_id = self._get_server_id('events', ev_data.id)
 
-        date_str = data_key.strftime("%Y-%m-%d")
-        date_end_str = date_end.strftime("%Y-%m-%d")
-        start_str = start_time.strftime("%H:%M")
-        end_str = end_time.strftime("%H:%M")
+        new_status = 0 if ev_data.is_completed else 1
 
-        query_sel = 'SELECT server_id FROM events WHERE name = ? AND start_date = ? AND end_date = ? AND time_start = ? AND time_end = ?'
-        res = self._execute_query(query_sel, (name, date_str, date_end_str, start_str, end_str), fetch_all=True)
-        server_id = res[0][0] if res and res[0] else None
-
-        new_status = 0 if is_completed else 1
-
-        query = '''
-                    UPDATE events 
-                    SET is_completed = ? 
-                    WHERE name = ? AND start_date = ? AND end_date = ? AND time_start = ? AND time_end = ?
-                '''
-        params = (new_status, name, date_str, date_end_str, start_str, end_str)
-        self._execute_query(query, params, commit=True)
+        self._execute_query("UPDATE events SET is_completed = ? WHERE id = ?", (new_status, ev_data.id), commit=True)
         self.load_data()
-        if server_id:
-            token = self._get_api_token()
-            if token:
-                payload = {'is_completed': new_status}
-                self.patch_worker = NetworkWorker(f"{SERVER_URL}/events/{server_id}", payload=payload, token=token,
-                                                  method='PATCH')
-                self.patch_thread = QThread()
-                self.patch_worker.moveToThread(self.patch_thread)
-                self.patch_thread.started.connect(self.patch_worker.run)
-                self.patch_worker.finished.connect(self.patch_thread.quit)
-                self.patch_worker.finished.connect(self.patch_worker.deleteLater)
-                self.patch_thread.finished.connect(self.patch_thread.deleteLater)
-                self.patch_thread.start()
+        if self._get_api_token():
+            self._outbox_record('events', ev_data.id, 'update', {'is_completed': new_status}, server_id=server_id)
+            self.flush_outbox()
 
     # -------------------------------------------------------------------
     # БЛОК 8: УПРАВЛЕНИЕ ЗАДАЧАМИ (Tasks)
@@ -789,29 +1024,12 @@ class SimplePlanner(QMainWindow):
                 'category': category,
                 'is_completed': 0
             }
-            print(payload)
-            self.task_thread = QThread()
-            self.task_worker = NetworkWorker(f"{SERVER_URL}/tasks", payload=payload, token=token)
-            self.task_worker.moveToThread(self.task_thread)
-
-            self.task_thread.started.connect(self.task_worker.run)
-            self.task_worker.finished.connect(lambda res: self._on_task_sent(res, local_id))
-
-            self.task_worker.finished.connect(self.task_thread.quit)
-            self.task_worker.finished.connect(self.task_worker.deleteLater)
-            self.task_thread.finished.connect(self.task_thread.deleteLater)
-            self.task_thread.start()
+            self._outbox_record('tasks', local_id, 'create', payload)
+            self.flush_outbox()
         self.taskName.clear()
         self.taskDes.clear()
         self.load_data()
 
-    def _on_task_sent(self, response, local_id):
-        server_id = response.get('id')
-        if server_id:
-            query = "UPDATE tasks SET server_id = ? WHERE id = ?"
-            self._execute_query(query, (server_id, local_id), commit=True)
-            print(f"Синхронизировано: local={local_id}, server={server_id}")
-
     def update_task_list(self):
         search = self.searchTask.text().lower()
         self.taskList.clear()
@@ -821,7 +1039,7 @@ class SimplePlanner(QMainWindow):
             tasks_list = self.tasks[category]
 
             if search:
-                matching = [t for t in tasks_list if search in t[0].lower()]
+                matching = [t for t in tasks_list if search in t.name.lower()]
             else:
                 matching = tasks_list
 
@@ -829,8 +1047,8 @@ class SimplePlanner(QMainWindow):
                 root = QTreeWidgetItem([category])
                 root.setData(0, Qt.ItemDataRole.UserRole, category)
 
-                for t in sorted(matching, key=lambda x: x[2]):
-                    name, desc, is_completed = t
+                for t in sorted(matching, key=lambda x: x.is_completed):
+                    name, desc, is_completed = t.name, t.description, t.is_completed
                     child = QTreeWidgetItem([name, desc])
                     child.setData(0, Qt.ItemDataRole.UserRole, t)
                     if is_completed:
@@ -852,91 +1070,38 @@ class SimplePlanner(QMainWindow):
 
     def _delete_task_logic(self, item):
         if item.parent():
-            cat = item.parent().data(0, Qt.ItemDataRole.UserRole)
             t_data = item.data(0, Qt.ItemDataRole.UserRole)
-            query_select = '''
-                SELECT server_id FROM tasks
-                WHERE name = ? AND description = ? AND category = ?
-            '''
-            params = (t_data[0], t_data[1], cat)
-            result = self._execute_query(query_select, params, fetch_all=True)
-            server_id = result[0][0] if result and result[0] else None
-
-            query = '''DELETE FROM tasks WHERE name = ? AND description = ? AND category = ?'''
-            params = (t_data[0], t_data[1], cat)
-            self._execute_query(query, params, commit=True)
-            if server_id:
-                token = self._get_api_token()
-                if token:
-                    self.del_task_worker = NetworkWorker(f"{SERVER_URL}/tasks/{server_id}", method="DELETE",
-                                                         token=token)
-                    self.del_thread = QThread()
-                    self.del_task_worker.moveToThread(self.del_thread)
-                    self.del_thread.started.connect(self.del_task_worker.run)
-                    self.del_task_worker.finished.connect(self.del_thread.quit)
-                    self.del_task_worker.finished.connect(self.del_thread.deleteLater)
-                    self.del_thread.finished.connect(self.del_thread.deleteLater)
-                    self.del_thread.start()
+            server_id = self._get_server_id('tasks', t_data.id)
+
+            self._execute_query("DELETE FROM tasks WHERE id = ?", (t_data.id,), commit=True)
+            if self._get_api_token():
+                self._outbox_record('tasks', t_data.id, 'delete', server_id=server_id)
+                self.flush_outbox()
             self.load_data()
         else:
-            cats = {'Срочно и важно': 'UaI', 'Важно, но не срочно': 'IbnN', 'Срочно, но не важно': 'UbnI',
-                    'Не срочно и не важно': 'NUanI'}
             cat = item.data(0, Qt.ItemDataRole.UserRole)
-            query = '''DELETE FROM tasks WHERE category = ?'''
-            params = (cat,)
-            self._execute_query(query, params, commit=True)
+            res = self._execute_query('SELECT id, server_id FROM tasks WHERE category = ?', (cat,), fetch_all=True)
+            with self.db.transaction():
+                self._execute_query('DELETE FROM tasks WHERE category = ?', (cat,), commit=True)
+                if self._get_api_token():
+                    for local_id, server_id in res or []:
+                        self._outbox_record('tasks', local_id, 'delete', server_id=server_id)
             self.load_data()
-
-            token = self._get_api_token()
-            if token and cats[cat]:
-                self.thread = QThread()
-                self.worker = NetworkWorker(f"{SERVER_URL}/tasks/{cats[cat]}", method="DELETE",
-                                            token=token)
-                self.worker.moveToThread(self.thread)
-                self.thread.started.connect(self.worker.run)
-
-                # Безопасная очистка (как в предыдущих рекомендациях)
-                self.worker.finished.connect(self.thread.quit)
-                self.worker.finished.connect(self.worker.deleteLater)
-                self.thread.finished.connect(self.thread.deleteLater)
-                self.worker.error.connect(self.thread.quit)  # Очистка при ошибке
-                self.worker.error.connect(self.worker.deleteLater)
-                self.thread.finished.connect(self.thread.deleteLater)
-
-                self.thread.start()
+            self.flush_outbox()
 
     def _toggle_task_completion(self, item):
         """Переключает статус выполнения события"""
-        cat = item.parent().data(0, Qt.ItemDataRole.UserRole)
         task = item.data(0, Qt.ItemDataRole.UserRole)
-        name, desc, is_completed = task
-
-        query_sel = 'SELECT server_id FROM tasks WHERE name = ? AND description = ? AND category = ?'
-        res = self._execute_query(query_sel, (name, desc, cat), fetch_all=True)
-        server_id = res[0][0] if res else None
+        server_id = self._get_server_id('tasks', task.id)
         # Инвертируем статус (1-0 или 0-1)
-        new_status = 0 if is_completed else 1
+        new_status = 0 if task.is_completed else 1
 
-        query = '''
-            UPDATE tasks 
-            SET is_completed = ? 
-            WHERE name = ? AND description = ? AND category = ?
-        '''
-        params = (new_status, name, desc, cat)
-
-        self._execute_query(query, params, commit=True)
+        self._execute_query("UPDATE tasks SET is_completed = ? WHERE id = ?", (new_status, task.id), commit=True)
         self.load_data()
 
-        if server_id:
-            token = self._get_api_token()
-            if token:
-                payload = {'is_completed': new_status}
-                self.patch_worker = NetworkWorker(f"{SERVER_URL}/tasks/{server_id}", payload=payload, token=token,
-                                                  method='PATCH')
-                self.patch_thread = QThread()
-                self.patch_worker.moveToThread(self.patch_thread)
-                self.patch_thread.started.connect(self.patch_worker.run)
-                self.patch_thread.start()
+        if self._get_api_token():
+            self._outbox_record('tasks', task.id, 'update', {'is_completed': new_status}, server_id=server_id)
+            self.flush_outbox()
 
     # -------------------------------------------------------------------
     # БЛОК 9: НАСТРОЙКИ UI И ЦВЕТА
@@ -1033,77 +1198,54 @@ class SimplePlanner(QMainWindow):
         if not token:
             return
 
-        # Настройка потока событий
-        # 1. Загрузка событий с сервера
-        self.sync_events_worker = NetworkWorker(f"{SERVER_URL}/events", method="GET", token=token)
-        self.sync_thread_ev = QThread()
-        self.sync_events_worker.moveToThread(self.sync_thread_ev)
-        self.sync_events_worker.finished.connect(self._process_server_events)
-        self.sync_thread_ev.started.connect(self.sync_events_worker.run)
-        # Очистка потоков
-        self.sync_events_worker.finished.connect(self.sync_thread_ev.quit)
-        self.sync_events_worker.finished.connect(self.sync_events_worker.deleteLater)
-        self.sync_thread_ev.finished.connect(self.sync_thread_ev.deleteLater)
-        self.sync_thread_ev.start()
-        # 2. Загрузка задач с сервера (аналогично)
-        self.sync_tasks_worker = NetworkWorker(f"{SERVER_URL}/tasks", method="GET", token=token)
-        self.sync_thread_task = QThread()
-        self.sync_tasks_worker.moveToThread(self.sync_thread_task)
-        self.sync_tasks_worker.finished.connect(self._process_server_tasks)
-        self.sync_thread_task.started.connect(self.sync_tasks_worker.run)
-        # Очистка потоков
-        self.sync_tasks_worker.finished.connect(self.sync_thread_task.quit)
-        self.sync_tasks_worker.finished.connect(self.sync_tasks_worker.deleteLater)
-        self.sync_thread_task.finished.connect(self.sync_thread_task.deleteLater)
-        self.sync_thread_task.start()
-
-    def _process_server_events(self, events_data):
-        if not isinstance(events_data, list):
+        # Сначала отправляем накопленные изменения, затем забираем чужие
+        self._queue_unsent()
+        self.flush_outbox()
+
+        # Запрашиваем только изменения после последнего курсора; если прошлая синхронизация
+        # ещё не ответила, тот же запрос повторно не уходит
+        self.net.request('GET', f"{SERVER_URL}/events?since={self._get_sync_cursor('events')}", token=token,
+                         on_success=self._process_server_events)
+        self.net.request('GET', f"{SERVER_URL}/tasks?since={self._get_sync_cursor('tasks')}", token=token,
+                         on_success=self._process_server_tasks)
+
+    def _process_server_events(self, delta):
+        if not isinstance(delta, dict):
             return
-        for ev in events_data:
-            server_id = ev['id']
-            check_query = "SELECT id FROM events WHERE server_id = ?"
-            res = self._execute_query(check_query, (server_id,), fetch_all=True)
-            if res:
-                query = '''
-                        UPDATE events SET
-                        name = ?, start_date = ?, end_date = ?, time_start = ?, time_end = ?, is_completed = ?
-                        WHERE server_id = ?
-                '''
-                t_start = ev['time_start'][:5]
-                t_end = ev['time_end'][:5]
-                params = (ev['event_name'], ev['start_date'], ev['end_date'], t_start, t_end, ev['is_completed'],
-                          server_id)
-                self._execute_query(query, params, commit=True)
-            else:
-                query = '''
-                    INSERT INTO events (name, start_date, end_date, time_start, time_end, is_completed, server_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                '''
-                t_start = ev['time_start'][:5]
-                t_end = ev['time_end'][:5]
-                params = (ev['event_name'], ev['start_date'], ev['end_date'], t_start, t_end, ev['is_completed'],
-                          server_id)
-                self._execute_query(query, params, commit=True)
+        # Вся дельта применяется одной транзакцией: удаления и upsert пачкой, интерфейс обновляется один раз
+        rows = [(ev['event_name'], ev['start_date'], ev['end_date'], ev['time_start'][:5], ev['time_end'][:5],
+                 ev['is_completed'], ev['id']) for ev in delta.get('items', [])]
+        with self.db.transaction():
+            self.db.executemany("DELETE FROM events WHERE server_id = ?",
+                                [(server_id,) for server_id in delta.get('deleted', [])])
+            self.db.executemany('''
+                INSERT INTO events (name, start_date, end_date, time_start, time_end, is_completed, server_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(server_id) DO UPDATE SET
+                    name = excluded.name, start_date = excluded.start_date, end_date = excluded.end_date,
+                    time_start = excluded.time_start, time_end = excluded.time_end, is_completed = excluded.is_completed
+            ''', rows)
+            self._save_sync_cursor('events', delta['cursor'])
+        if rows or delta.get('deleted'):
             self.load_data()
 
-    def _process_server_tasks(self, tasks_data):
-        if not isinstance(tasks_data, list):
+    def _process_server_tasks(self, delta):
+        if not isinstance(delta, dict):
             return
-        for task in tasks_data:
-            server_id = task['id']
-            check_query = "SELECT id FROM tasks WHERE server_id = ?"
-            res = self._execute_query(check_query, (server_id,), fetch_all=True)
-            if res:
-                query = "UPDATE tasks SET name=?, description=?, category=?, is_completed=? WHERE server_id=?"
-                params = (task['name'], task['description'], task['category'], task['is_completed'], server_id)
-                self._execute_query(query, params, commit=True)
-            else:
-                query = "INSERT INTO tasks (name, description, category, is_completed, server_id) VALUES (?, ?, ?, ?, ?)"
-                params = (task['name'], task['description'], task['category'], task['is_completed'], server_id)
-                self._execute_query(query, params, commit=True)
-        self.load_data()
-
+        rows = [(task['name'], task['description'], task['category'], task['is_completed'], task['id'])
+                for task in delta.get('items', [])]
+        with self.db.transaction():
+            self.db.executemany("DELETE FROM tasks WHERE server_id = ?",
+                                [(server_id,) for server_id in delta.get('deleted', [])])
+            self.db.executemany('''
+                INSERT INTO tasks (name, description, category, is_completed, server_id) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(server_id) DO UPDATE SET
+                    name = excluded.name, description = excluded.description, category = excluded.category,
+                    is_completed = excluded.is_completed
+            ''', rows)
+            self._save_sync_cursor('tasks', delta['cursor'])
+        if rows or delta.get('deleted'):
+            self.load_data()
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -0,0 +1,54 @@
+"""Замер пропускной способности webhook.
+
+Шлёт N обновлений с командой в webhook API от разных пользователей и печатает, сколько
+обновлений в секунду было принято. Бот при этом должен смотреть в fake_telegram.py:
+
+    python -m server.Bot.fake_telegram 8081
+    BOT_MODE=webhook RUN_SCHEDULER=0 TELEGRAM_API_URL=http://127.0.0.1:8081 \
+        uvicorn server.FastApi.main_server:app --port 8000
+    python -m server.Bot.bench_webhook http://127.0.0.1:8000 2000 /start
+
+Приём — это ещё не обработка: сколько сообщений бот успел отправить, показывает GET /stats заглушки.
+"""
+import asyncio
+import sys
+import time
+
+import httpx
+
+from server import config
+
+
+def make_update(update_id: int, text: str) -> dict:
+    user = {"id": 100000 + update_id % 1000, "is_bot": False, "first_name": "Bench"}
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": int(time.time()), "text": text,
+                        "chat": {"id": user["id"], "type": "private"}, "from": user,
+                        "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}}
+
+
+async def main(base_url: str, count: int, text: str, parallel: int = 64):
+    url = base_url.rstrip('/') + config.WEBHOOK_PATH
+    headers = {'X-Telegram-Bot-Api-Secret-Token': config.WEBHOOK_SECRET} if config.WEBHOOK_SECRET else {}
+    queue = iter(range(count))
+    errors = 0
+
+    async with httpx.AsyncClient(headers=headers, timeout=30) as client:
+        async def worker():
+            nonlocal errors
+            for update_id in queue:
+                response = await client.post(url, json=make_update(update_id, text))
+                errors += response.status_code != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(parallel)))
+        elapsed = time.perf_counter() - started
+
+    print(f'{count} updates in {elapsed:.2f}s: {count / elapsed:.0f} updates/s, {errors} errors')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    asyncio.run(main(args[0] if args else 'http://127.0.0.1:8000',
+                     int(args[1]) if len(args) > 1 else 1000,
+                     args[2] if len(args) > 2 else '/start'))
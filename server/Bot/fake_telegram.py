@@ -0,0 +1,51 @@
+"""Заглушка Bot API для локальных замеров без обращения к Telegram.
+
+Запуск: python -m server.Bot.fake_telegram [порт]
+Бот направляется сюда через TELEGRAM_API_URL=http://127.0.0.1:8081.
+Ответ на каждый запрос задерживается на FAKE_TELEGRAM_LATENCY_MS, как у настоящего API.
+Сколько вызовов каждого метода пришло, видно на GET /stats.
+"""
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+LATENCY = int(os.getenv('FAKE_TELEGRAM_LATENCY_MS', '50')) / 1000
+
+app = FastAPI()
+calls = Counter()
+message_ids = iter(range(1, sys.maxsize))
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Planner", "username": "planner_bot"}
+
+
+def message(chat_id, text):
+    return {"message_id": next(message_ids), "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"}, "from": BOT_USER, "text": text or ''}
+
+
+@app.get('/stats')
+async def stats():
+    return dict(calls)
+
+
+@app.post('/bot{token}/{method}')
+async def bot_method(token: str, method: str, request: Request):
+    # Без файлов aiogram шлёт параметры как application/x-www-form-urlencoded
+    form = dict(parse_qsl((await request.body()).decode()))
+    calls[method] += 1
+    await asyncio.sleep(LATENCY)
+    if method == 'getMe':
+        return {"ok": True, "result": BOT_USER}
+    if method in ('sendMessage', 'editMessageText'):
+        return {"ok": True, "result": message(form.get('chat_id', 0), form.get('text'))}
+    return {"ok": True, "result": True}
+
+
+if __name__ == '__main__':
+    uvicorn.run(app, host='127.0.0.1', port=int(sys.argv[1]) if len(sys.argv) > 1 else 8081, log_level='warning')
@@ -0,0 +1,118 @@
+"""Хранилище состояний диалогов бота в базе данных.
+
+Состояния переживают перезапуск и общие для всех воркеров бота. Диалог, к которому не
+возвращались FSM_TTL_MINUTES, считается брошенным: он не читается и со временем удаляется.
+"""
+import json
+from datetime import date, datetime, time, timedelta
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import select, delete, case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from server import config
+from server.DB.database import AsyncSessionLocal, async_engine
+from server.DB.models import FsmState
+
+CLEANUP_INTERVAL = timedelta(minutes=10)
+
+# Даты и время в данных диалога (start_date, time_start, ...) сохраняются с пометкой типа
+_TYPES = {'date': date, 'time': time, 'datetime': datetime}
+
+
+def _encode(value):
+    for name, cls in reversed(_TYPES.items()):  # datetime раньше date: он её подкласс
+        if isinstance(value, cls):
+            return {'__type__': name, 'value': value.isoformat()}
+    raise TypeError(f'Cannot store {type(value).__name__} in FSM data')
+
+
+def _decode(obj: dict):
+    if obj.keys() == {'__type__', 'value'} and obj['__type__'] in _TYPES:
+        return _TYPES[obj['__type__']].fromisoformat(obj['value'])
+    return obj
+
+
+def dumps(data: Mapping[str, Any]) -> str:
+    return json.dumps(data, default=_encode, ensure_ascii=False)
+
+
+def loads(raw: str) -> dict:
+    return json.loads(raw, object_hook=_decode)
+
+
+class DBStorage(BaseStorage):
+    def __init__(self, ttl: timedelta = None):
+        self.ttl = ttl or timedelta(minutes=config.FSM_TTL_MINUTES)
+        self.last_cleanup = datetime.min
+
+    @staticmethod
+    def make_key(key: StorageKey) -> str:
+        return ':'.join(str(part or '') for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                                                     key.business_connection_id, key.destiny))
+
+    async def _load(self, key: StorageKey):
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(
+                select(FsmState.state, FsmState.data)
+                .where(FsmState.key == self.make_key(key), FsmState.updated_at >= datetime.now() - self.ttl)
+            )).first()
+
+    async def _save(self, key: StorageKey, **values):
+        """Обновляет строку диалога (или создаёт её) одним upsert; пустой диалог без состояния удаляется.
+
+        Апдейты одного чата обрабатываются параллельно, поэтому чтение перед вставкой здесь не годится:
+        две первые записи одного ключа столкнулись бы на первичном ключе.
+        """
+        now = datetime.now()
+        storage_key = self.make_key(key)
+        empty = {'state': None, 'data': '{}'}
+        insert = postgresql.insert if async_engine.dialect.name == 'postgresql' else sqlite.insert
+        query = insert(FsmState).values(key=storage_key, updated_at=now, **{**empty, **values})
+        expired = FsmState.updated_at < now - self.ttl
+        # Незаданное поле сохраняется, а у брошенного диалога сбрасывается
+        query = query.on_conflict_do_update(index_elements=[FsmState.key], set_={
+            'updated_at': query.excluded.updated_at,
+            **{name: query.excluded[name] if name in values
+               else case((expired, default), else_=getattr(FsmState, name))
+               for name, default in empty.items()},
+        }).returning(FsmState.state, FsmState.data)
+        async with AsyncSessionLocal() as db:
+            state, data = (await db.execute(query)).one()
+            if state is None and data == '{}':
+                await db.execute(delete(FsmState).where(FsmState.key == storage_key, FsmState.state.is_(None),
+                                                        FsmState.data == '{}'))
+            await db.commit()
+        if now - self.last_cleanup > CLEANUP_INTERVAL:
+            await self.cleanup(now)
+
+    async def cleanup(self, now: datetime = None):
+        now = now or datetime.now()
+        self.last_cleanup = now
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(FsmState).where(FsmState.updated_at < now - self.ttl))
+            await db.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._save(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        row = await self._load(key)
+        return row.state if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._save(key, data=dumps(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        row = await self._load(key)
+        return loads(row.data) if row else {}
+
+    async def close(self) -> None:
+        pass
+
+
+def create_storage() -> BaseStorage:
+    return DBStorage() if config.FSM_STORAGE == 'db' else MemoryStorage()
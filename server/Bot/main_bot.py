@@ -0,0 +1,45 @@
+"""Бот отдельным процессом: только поллинг Telegram, без API и планировщика.
+
+В режиме webhook (BOT_MODE=webhook) обновления принимает API, этот процесс не нужен.
+"""
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from server import config
+from server.DB.database import engine
+from server.DB.migrations import run_migrations
+from server.Bot.fsm_storage import create_storage
+from server.Bot.tg_bot import router
+
+logger = logging.getLogger(__name__)
+
+
+def create_bot() -> Bot:
+    if config.TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL))
+        return Bot(token=config.BOT_TOKEN, session=session)
+    return Bot(token=config.BOT_TOKEN)
+
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=create_storage())
+    dp.include_router(router)
+    return dp
+
+
+async def main():
+    run_migrations(engine)
+    bot = create_bot()
+    try:
+        await create_dispatcher().start_polling(bot)
+    finally:
+        await bot.session.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
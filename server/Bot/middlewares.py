@@ -0,0 +1,43 @@
+"""Middleware бота."""
+from typing import Any, Awaitable, Callable, Dict, NamedTuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import select
+
+from server.cache import make_cache
+from server.DB.database import AsyncSessionLocal
+from server.DB.models import User
+
+# telegram_id -> пользователь; привязка меняется только в /start, который сбрасывает запись
+user_cache = make_cache('bot_user:', maxsize=10000, ttl=600)
+
+
+class BotUser(NamedTuple):
+    id: int
+    telegram_id: str
+
+
+async def resolve_user(telegram_id: str) -> BotUser | None:
+    cached = await user_cache.get(telegram_id)
+    if cached is not None:
+        return BotUser(*cached)
+    async with AsyncSessionLocal() as db:
+        user_id = await db.scalar(select(User.id).where(User.telegram_id == telegram_id))
+    if user_id is None:
+        return None  # Незарегистрированных не кэшируем: после /start пользователь появится сразу
+    user = BotUser(user_id, telegram_id)
+    await user_cache.set(telegram_id, user)
+    return user
+
+
+class UserMiddleware(BaseMiddleware):
+    """Передаёт обработчикам аргумент user: BotUser или None, если пользователь не зарегистрирован."""
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: Dict[str, Any]) -> Any:
+        from_user = data.get('event_from_user')
+        data['user'] = await resolve_user(str(from_user.id)) if from_user else None
+        return await handler(event, data)
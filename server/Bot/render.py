@@ -0,0 +1,168 @@
+"""Тексты и клавиатуры сообщений бота со списками событий и задач.
+
+Готовые сообщения запоминаются по (пользователь, что показано, sync_version). Любая запись
+пользователя увеличивает sync_version, поэтому устаревшее сообщение просто перестаёт находиться,
+а повторный просмотр без изменений стоит одного чтения версии по первичному ключу.
+"""
+from datetime import date, time
+from typing import NamedTuple
+
+from aiogram import types
+from sqlalchemy import select
+
+from server.cache import TTLCache
+from server.DB.models import User, Event
+from server.DB.summary import task_summary
+
+render_cache = TTLCache(maxsize=5000, ttl=600)
+
+
+class DayEvent(NamedTuple):
+    """Событие в сообщении со списком дня; поля названы как у модели Event."""
+    id: int
+    event_name: str
+    start_date: date
+    time_start: time
+    end_date: date
+    time_end: time
+    is_completed: int
+
+
+DAY_EVENT_COLUMNS = [getattr(Event, field) for field in DayEvent._fields]
+
+
+class DayView(NamedTuple):
+    text: str
+    keyboard: types.InlineKeyboardMarkup | None
+    events: list[DayEvent]
+
+
+async def user_version(db, user_id: int) -> int:
+    return await db.scalar(select(User.sync_version).where(User.id == user_id))
+
+
+def event_line(e) -> str:
+    status_icon = "✅" if e.is_completed else "⏳"
+    if e.start_date == e.end_date:
+        time_range = f"{e.time_start.strftime('%H:%M')} - {e.time_end.strftime('%H:%M')}"
+        return f"{status_icon} **{e.event_name}** ({time_range})"
+    start_dt = f"{e.start_date.strftime('%d.%m')} {e.time_start.strftime('%H:%M')}"
+    end_dt = f"{e.end_date.strftime('%d.%m')} {e.time_end.strftime('%H:%M')}"
+    return f"{status_icon} **{e.event_name}**\n      └ {start_dt} — {end_dt}"
+
+
+def render_day(day: date, events: list[DayEvent]) -> DayView:
+    date_str = day.strftime('%d.%m.%Y')
+    if not events:
+        return DayView(f"На {date_str} событий нет.", None, events)
+
+    text = "\n".join([f"📅 **События на {date_str}**\n", *(event_line(e) for e in events)])
+    # Кнопка переключает статус: выполненное событие можно вернуть в работу
+    buttons = [
+        types.InlineKeyboardButton(text=f'❌ {e.event_name}', callback_data=f'change_{e.id}_0_{date_str}')
+        if e.is_completed else
+        types.InlineKeyboardButton(text=f'✅ {e.event_name}', callback_data=f'change_{e.id}_1_{date_str}')
+        for e in events
+    ]
+    return DayView(text, types.InlineKeyboardMarkup(inline_keyboard=[buttons]), events)
+
+
+async def day_view(db, user_id: int, day: date) -> DayView:
+    version = await user_version(db, user_id)
+    view = render_cache.get(('day', user_id, day, version))
+    if view is None:
+        rows = await db.execute(select(*DAY_EVENT_COLUMNS)
+                                .where(Event.user_id == user_id, Event.start_date == day).order_by(Event.id))
+        view = remember_day(user_id, day, version, [DayEvent(*row) for row in rows])
+    return view
+
+
+def cached_day(user_id: int, day: date, version: int) -> DayView | None:
+    return render_cache.get(('day', user_id, day, version))
+
+
+def remember_day(user_id: int, day: date, version: int, events: list[DayEvent]) -> DayView:
+    view = render_day(day, events)
+    render_cache.set(('day', user_id, day, version), view)
+    return view
+
+
+DATES_PER_PAGE = 2
+
+
+def date_cursor(direction: str, value) -> str:
+    # page_n_ГГГГММДД — даты после указанной, page_p_ГГГГММДД — даты до неё
+    return f"page_{direction}_{value.strftime('%Y%m%d')}"
+
+
+def render_dates(dates: list[date], has_prev: bool, has_next: bool):
+    if not dates:
+        return None, "📭 Доступных дат нет."
+
+    # Кнопки с датами по 2 в ряд
+    buttons = []
+    for i in range(0, len(dates), 2):
+        buttons.append([types.InlineKeyboardButton(text=day.strftime('%d.%m.%Y'),
+                                                   callback_data=f"date_{day.strftime('%d.%m.%Y')}")
+                        for day in dates[i:i + 2]])
+
+    # Кнопки навигации
+    nav_buttons = []
+    if has_prev:
+        nav_buttons.append(types.InlineKeyboardButton(text='⬅️ Пред.', callback_data=date_cursor('p', dates[0])))
+    if has_next:
+        nav_buttons.append(types.InlineKeyboardButton(text='След. ➡️', callback_data=date_cursor('n', dates[-1])))
+    if nav_buttons:
+        buttons.append(nav_buttons)
+
+    return types.InlineKeyboardMarkup(inline_keyboard=buttons), "📅 Выберите дату для просмотра событий:"
+
+
+async def dates_view(db, user_id: int, after: date = None, before: date = None):
+    """Страница дат с событиями по ключу: читается DATES_PER_PAGE + 1 дата от курсора, а не все даты."""
+    version = await user_version(db, user_id)
+    key = ('dates', user_id, after, before, version)
+    view = render_cache.get(key)
+    if view is not None:
+        return view
+
+    query = select(Event.start_date).distinct().where(Event.user_id == user_id)
+    if before is not None:
+        # Назад: ближайшие даты перед курсором, потом разворачиваем по возрастанию
+        rows = (await db.scalars(query.where(Event.start_date < before)
+                                 .order_by(Event.start_date.desc()).limit(DATES_PER_PAGE + 1))).all()
+        view = render_dates(rows[:DATES_PER_PAGE][::-1], len(rows) > DATES_PER_PAGE, True)
+    else:
+        if after is not None:
+            query = query.where(Event.start_date > after)
+        rows = (await db.scalars(query.order_by(Event.start_date.asc()).limit(DATES_PER_PAGE + 1))).all()
+        view = render_dates(rows[:DATES_PER_PAGE], after is not None, len(rows) > DATES_PER_PAGE)
+    render_cache.set(key, view)
+    return view
+
+
+TASKS_PER_CATEGORY = 10
+
+
+def render_tasks(summary: list[dict]) -> str:
+    if not summary:
+        return "У вас нет задач."
+
+    response = ["📝 **Ваши задачи**"]
+    for group in summary:
+        response.append(f"• {group['category']} ({group['completed']}/{group['total']})")
+        for task in group['items']:
+            description = f" ({task['description']})" if task['description'] else ""
+            response.append(f"    ◦ {task['name']}{description} {'✅' if task['is_completed'] else '⏳'}")
+        if group['total'] > len(group['items']):
+            response.append(f"    … и ещё {group['total'] - len(group['items'])}")
+    return "\n".join(response)
+
+
+async def tasks_view(db, user_id: int) -> str:
+    version = await user_version(db, user_id)
+    text = render_cache.get(('tasks', user_id, version))
+    if text is None:
+        text = render_tasks(await task_summary(db, user_id, per_category=TASKS_PER_CATEGORY))
+        render_cache.set(('tasks', user_id, version), text)
+    return text
@@ -7,10 +7,18 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram import F
 from datetime import datetime
-from server.DB.database import SessionLocal
+from sqlalchemy import select, update
+from server.DB.database import AsyncSessionLocal
 from server.DB.models import User, Event, Task
+from server.DB.sync import next_version
+from server.Scheduler.reminders import reminder_fields
+from server.Scheduler.digest import default_digest_time
+from server.Bot.middlewares import UserMiddleware, BotUser, user_cache
+from server.Bot.render import DayEvent, DAY_EVENT_COLUMNS, day_view, cached_day, remember_day, dates_view, tasks_view
 
 router = Router()
+router.message.middleware(UserMiddleware())
+router.callback_query.middleware(UserMiddleware())
 
 
 class CreateEvent(StatesGroup):
@@ -51,15 +59,18 @@ async def cmd_start(message: types.Message):
         input_field_placeholder="Выберите способ подачи"
     )
 
-    with SessionLocal() as db:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.telegram_id == telegram_id))
         if not user:
             user = User(telegram_id=telegram_id)
             db.add(user)
+            await db.flush()
+            user.digest_time = default_digest_time(user.id)
 
         # Всегда обновляем код при запросе /start, если токена еще нет или нужна перепривязка
         user.link_code = link_code
-        db.commit()
+        await db.commit()
+        await user_cache.pop(telegram_id)
 
         text = (
             "🔗 **Связывание устройства**\n"
@@ -69,193 +80,119 @@ async def cmd_start(message: types.Message):
         await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
 
 
+@router.message(Command("digest"))
+async def cmd_digest(message: types.Message, command: CommandObject, user: BotUser | None):
+    try:
+        digest_time = datetime.strptime(command.args or '', '%H:%M').time()
+    except ValueError:
+        await message.answer("⚠️ Укажите время утренней сводки в формате ЧЧ:ММ, например /digest 08:30")
+        return
+    if not user:
+        await message.answer("❌ Вы не зарегистрированы.")
+        return
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(User).where(User.id == user.id).values(digest_time=digest_time))
+        await db.commit()
+    await message.answer(f"Сводка событий будет приходить в {digest_time.strftime('%H:%M')}")
+
+
 # -------------------------------------------------------------------
 # Логика событий
 # -------------------------------------------------------------------
 
-DATES_PER_PAGE = 2
-
-
-async def get_dates_keyboard(user_id: int, page: int = 0):
-    with SessionLocal() as db:
-        # Получаем уникальные даты, отсортированные по возрастанию
-        dates_query = db.query(Event.start_date).distinct().filter(
-            Event.user_id == user_id
-        ).order_by(Event.start_date.asc()).all()
-
-        dates_list = [d[0].strftime('%d.%m.%Y') for d in dates_query]
-
-        if not dates_list:
-            return None, "📭 Доступных дат нет."
-
-        # Вычисляем границы для текущей страницы
-        start_idx = page * DATES_PER_PAGE
-        end_idx = start_idx + DATES_PER_PAGE
-        current_page_dates = dates_list[start_idx:end_idx]
-
-        # Создаем кнопки с датами (по 2 в ряд для красоты)
-        buttons = []
-        row = []
-        for date_str in current_page_dates:
-            row.append(types.InlineKeyboardButton(text=date_str, callback_data=f'date_{date_str}'))
-            if len(row) == 2:
-                buttons.append(row)
-                row = []
-        if row: buttons.append(row)
-
-        # Кнопки навигации
-        nav_buttons = []
-        if page > 0:
-            nav_buttons.append(types.InlineKeyboardButton(text='⬅️ Пред.', callback_data=f'page_{page - 1}'))
-        if end_idx < len(dates_list):
-            nav_buttons.append(types.InlineKeyboardButton(text='След. ➡️', callback_data=f'page_{page + 1}'))
-
-        if nav_buttons:
-            buttons.append(nav_buttons)
-
-        return types.InlineKeyboardMarkup(inline_keyboard=buttons), "📅 Выберите дату для просмотра событий:"
+async def get_dates_keyboard(user_id: int, after=None, before=None):
+    async with AsyncSessionLocal() as db:
+        return await dates_view(db, user_id, after=after, before=before)
 
 
 @router.message(F.text.lower() == "события")
-async def cmd_events_list(message: types.Message):
-    with SessionLocal() as db:
-        user = db.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-        if not user:
-            await message.answer("❌ Вы не зарегистрированы.")
-            return
+async def cmd_events_list(message: types.Message, user: BotUser | None):
+    if not user:
+        await message.answer("❌ Вы не зарегистрированы.")
+        return
 
-        kb, text = await get_dates_keyboard(user.id, page=0)
-        await message.answer(text, reply_markup=kb)
+    kb, text = await get_dates_keyboard(user.id)
+    await message.answer(text, reply_markup=kb)
 
 
 @router.callback_query(F.data.startswith('date_'))
-async def cmd_events_dates(callback: types.CallbackQuery):
+async def cmd_events_dates(callback: types.CallbackQuery, user: BotUser | None):
     date = callback.data.split('_')[1]
-    with SessionLocal() as db:
-        user = db.query(User).filter(User.telegram_id == str(callback.from_user.id)).first()
-        try:
-            query_date = datetime.strptime(date, '%d.%m.%Y').date()
-        except ValueError:
-            await callback.message.answer("⚠️ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
-            return
-
-        events = db.query(Event).filter(Event.user_id == user.id, Event.start_date == query_date).all()
-
-        if not events:
-            await callback.message.answer(f"На {query_date.strftime('%d.%m.%Y')} событий нет.")
-            return
+    try:
+        query_date = datetime.strptime(date, '%d.%m.%Y').date()
+    except ValueError:
+        await callback.message.answer("⚠️ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+        return
 
-        response = [f"📅 **События на {query_date.strftime('%d.%m.%Y')}**\n"]
-        for e in events:
-            # Выбираем иконку в зависимости от статуса
-            status_icon = "✅" if e.is_completed else "⏳"
-
-            if e.start_date == e.end_date:
-                time_range = f"{e.time_start.strftime('%H:%M')} - {e.time_end.strftime('%H:%M')}"
-                response.append(f"{status_icon} **{e.event_name}** ({time_range})")
-            else:
-                start_dt = f"{e.start_date.strftime('%d.%m')} {e.time_start.strftime('%H:%M')}"
-                end_dt = f"{e.end_date.strftime('%d.%m')} {e.time_end.strftime('%H:%M')}"
-                response.append(f"{status_icon} **{e.event_name}**\n      └ {start_dt} — {end_dt}")
-
-        buttons = []
-        for e in events:
-            if e.is_completed:
-                buttons.append(
-                    types.InlineKeyboardButton(text=f'❌ {e.event_name}', callback_data=f'change_{e.id}_0_{date}'))
-            else:
-                buttons.append(
-                    types.InlineKeyboardButton(text=f'✅ {e.event_name}', callback_data=f'change_{e.id}_1_{date}'))
-            kb = types.InlineKeyboardMarkup(inline_keyboard=[buttons])
-        await callback.message.answer("\n".join(response), parse_mode="Markdown", reply_markup=kb)
+    async with AsyncSessionLocal() as db:
+        view = await day_view(db, user.id, query_date)
+    await callback.message.answer(view.text, parse_mode="Markdown", reply_markup=view.keyboard)
 
 
 @router.callback_query(F.data.startswith('change_'))
-async def cmd_events_change(callback: types.CallbackQuery):
+async def cmd_events_change(callback: types.CallbackQuery, user: BotUser | None):
     ev_id = int(callback.data.split('_')[1])
     ev_status = int(callback.data.split('_')[2])
     date = callback.data.split('_')[3]
     query_date = datetime.strptime(date, '%d.%m.%Y').date()
-    with SessionLocal() as db:
-        user = db.query(User).filter(User.telegram_id == str(callback.from_user.id)).first()
-        if ev_status == 1:
-            db.query(Event).filter(Event.id == ev_id).update({Event.is_completed: 1})
-            db.commit()
-            await callback.answer("Статус события изменен на ❌", show_alert=True)
-        else:
-            db.query(Event).filter(Event.id == ev_id).update({Event.is_completed: 0})
-            db.commit()
-            await callback.answer("Статус события изменен на ✅", show_alert=True)
-        events = db.query(Event).filter(Event.user_id == user.id, Event.start_date == date).all()
-    response = [f"📅 **События на {query_date.strftime('%d.%m.%Y')}**\n"]
-    for e in events:
-        # Выбираем иконку в зависимости от статуса
-        status_icon = "✅" if e.is_completed else "⏳"
-
-        if e.start_date == e.end_date:
-            time_range = f"{e.time_start.strftime('%H:%M')} - {e.time_end.strftime('%H:%M')}"
-            response.append(f"{status_icon} **{e.event_name}** ({time_range})")
-        else:
-            start_dt = f"{e.start_date.strftime('%d.%m')} {e.time_start.strftime('%H:%M')}"
-            end_dt = f"{e.end_date.strftime('%d.%m')} {e.time_end.strftime('%H:%M')}"
-            response.append(f"{status_icon} **{e.event_name}**\n      └ {start_dt} — {end_dt}")
-
-    buttons = []
-    kb = None
-    for e in events:
-        if e.is_completed:
-            buttons.append(
-                types.InlineKeyboardButton(text=f'❌ {e.event_name}', callback_data=f'change_{e.id}_0_{date}'))
+    async with AsyncSessionLocal() as db:
+        version = await next_version(db, user.id)
+        # Одно обновление только своего события; изменённая строка возвращается сразу
+        changed = (await db.execute(
+            update(Event)
+            .where(Event.id == ev_id, Event.user_id == user.id)
+            .values(is_completed=ev_status, version=version)
+            .returning(*DAY_EVENT_COLUMNS)
+        )).first()
+        if changed is None:
+            await db.rollback()
+            await callback.answer("Событие не найдено", show_alert=True)
+            return
+        await db.commit()
+        changed = DayEvent(*changed)
+
+        # Сообщение до переключения было показано с версией version - 1: если оно в кэше,
+        # достаточно заменить в нём одно событие, иначе день перечитывается
+        shown = cached_day(user.id, query_date, version - 1)
+        if shown is not None and any(e.id == changed.id for e in shown.events):
+            view = remember_day(user.id, query_date, version,
+                                [changed if e.id == changed.id else e for e in shown.events])
         else:
-            buttons.append(
-                types.InlineKeyboardButton(text=f'✅ {e.event_name}', callback_data=f'change_{e.id}_1_{date}'))
-        kb = types.InlineKeyboardMarkup(inline_keyboard=[buttons])
-    await callback.message.edit_text("\n".join(response), parse_mode="Markdown", reply_markup=kb)
+            view = await day_view(db, user.id, query_date)
+    await callback.answer("Статус события изменен на ❌" if ev_status == 1 else "Статус события изменен на ✅",
+                          show_alert=True)
+    await callback.message.edit_text(view.text, parse_mode="Markdown", reply_markup=view.keyboard)
 
 @router.callback_query(F.data.startswith('page_'))
-async def process_page_callback(callback: types.CallbackQuery):
-    page = int(callback.data.split('_')[1])
-    with SessionLocal() as db:
-        user = db.query(User).filter(User.telegram_id == str(callback.from_user.id)).first()
-        kb, text = await get_dates_keyboard(user.id, page=page)
+async def process_page_callback(callback: types.CallbackQuery, user: BotUser | None):
+    try:
+        _, direction, value = callback.data.split('_')
+        cursor = datetime.strptime(value, '%Y%m%d').date()
+    except ValueError:
+        direction, cursor = 'n', None  # Кнопки старого формата открывают первую страницу
+    if direction == 'p':
+        kb, text = await get_dates_keyboard(user.id, before=cursor)
+    else:
+        kb, text = await get_dates_keyboard(user.id, after=cursor)
 
-        # Редактируем сообщение только если клавиатура существует
-        if kb:
-            await callback.message.edit_reply_markup(reply_markup=kb)
-        await callback.answer()
+    # Редактируем сообщение только если клавиатура существует
+    if kb:
+        await callback.message.edit_reply_markup(reply_markup=kb)
+    await callback.answer()
 
 
 
 @router.message(Command("events"))
-async def cmd_events(message: types.Message, command: CommandObject):
-    with SessionLocal() as db:
-        user = db.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-        try:
-            query_date = datetime.strptime(command.args, '%d.%m.%Y').date()
-        except ValueError:
-            await message.answer("⚠️ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
-            return
-
-        events = db.query(Event).filter(Event.user_id == user.id, Event.start_date == query_date).all()
-
-        if not events:
-            await message.answer(f"На {query_date.strftime('%d.%m.%Y')} событий нет.")
-            return
-
-        response = [f"📅 **События на {query_date.strftime('%d.%m.%Y')}**\n"]
-        for e in events:
-            # Выбираем иконку в зависимости от статуса
-            status_icon = "✅" if e.is_completed else "⏳"
-
-            if e.start_date == e.end_date:
-                time_range = f"{e.time_start.strftime('%H:%M')} - {e.time_end.strftime('%H:%M')}"
-                response.append(f"{status_icon} **{e.event_name}** ({time_range})")
-            else:
-                start_dt = f"{e.start_date.strftime('%d.%m')} {e.time_start.strftime('%H:%M')}"
-                end_dt = f"{e.end_date.strftime('%d.%m')} {e.time_end.strftime('%H:%M')}"
-                response.append(f"{status_icon} **{e.event_name}**\n      └ {start_dt} — {end_dt}")
+async def cmd_events(message: types.Message, command: CommandObject, user: BotUser | None):
+    try:
+        query_date = datetime.strptime(command.args, '%d.%m.%Y').date()
+    except ValueError:
+        await message.answer("⚠️ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+        return
 
-        await message.answer("\n".join(response), parse_mode="Markdown")
+    async with AsyncSessionLocal() as db:
+        view = await day_view(db, user.id, query_date)
+    await message.answer(view.text, parse_mode="Markdown")
 
 
 @router.message(F.text.lower() == "создать событие")
@@ -314,12 +251,10 @@ async def create_event_end(message: types.Message, state: FSMContext):
 
 
 @router.message(CreateEvent.chose)
-async def create_event_chose(message: types.Message, state: FSMContext):
+async def create_event_chose(message: types.Message, state: FSMContext, user: BotUser | None):
     if message.text.lower() == "да":
         data = await state.get_data()
-        with SessionLocal() as db:
-            user = db.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-
+        async with AsyncSessionLocal() as db:
             if user:
                 new_event = Event(
                     user_id=user.id,
@@ -329,10 +264,12 @@ async def create_event_chose(message: types.Message, state: FSMContext):
                     end_date=data['date_end'],
                     time_end=data['time_end'],
                     notify_at=datetime.combine(data['start_date'], data['time_start']),
-                    is_completed=0
+                    is_completed=0,
+                    version=await next_version(db, user.id),
+                    **reminder_fields(datetime.combine(data['start_date'], data['time_start']))
                 )
                 db.add(new_event)
-                db.commit()
+                await db.commit()
         await message.answer("Событие успешно создано.")
         await state.clear()
         return
@@ -347,43 +284,13 @@ async def create_event_chose(message: types.Message, state: FSMContext):
 
 
 @router.message(F.text.lower() == "задачи")
-async def cmd_tasks(message: types.Message):
-    with SessionLocal() as db:
-        user = db.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
-        if not user:
-            await message.answer("Вы не зарегистрированы.")
-            return
-        tasks = db.query(Task).filter(Task.user_id == user.id).all()
-        if not tasks:
-            await message.answer("У вас нет задач.")
-            return
-        response = [f"📝 **Ваши задачи**"]
-        category = {}
-        for task in tasks:
-            if task.category in category:
-                if task.description:
-                    category[task.category].append((task.name, task.description, task.is_completed))
-                else:
-                    category[task.category].append((task.name, task.is_completed))
-            else:
-                if task.description:
-                    category[task.category] = [(task.name, task.description, task.is_completed)]
-                else:
-                    category[task.category] = [(task.name, task.is_completed)]
-        for cat in category:
-            response.append(f"• {cat}")
-            for task in category[cat]:
-                if len(task) == 3:
-                    if task[2]:
-                        response.append(f"    ◦ {task[0]} ({task[1]}) ✅")
-                    else:
-                        response.append(f"    ◦ {task[0]} ({task[1]}) ⏳")
-                else:
-                    if task[1]:
-                        response.append(f"    ◦ {task[0]} ✅")
-                    else:
-                        response.append(f"    ◦ {task[0]} ⏳")
-        await message.answer("\n".join(response), parse_mode="Markdown")
+async def cmd_tasks(message: types.Message, user: BotUser | None):
+    if not user:
+        await message.answer("Вы не зарегистрированы.")
+        return
+    async with AsyncSessionLocal() as db:
+        text = await tasks_view(db, user.id)
+    await message.answer(text, parse_mode="Markdown")
 
 
 @router.message(F.text.lower() == "создать задачу")
@@ -430,21 +337,21 @@ async def create_task_category(message: types.Message, state: FSMContext):
 
 
 @router.message(CreateTask.check)
-async def create_task_check(message: types.Message, state: FSMContext):
+async def create_task_check(message: types.Message, state: FSMContext, user: BotUser | None):
     if message.text.lower() == "да":
         data = await state.get_data()
-        with SessionLocal() as db:
-            user = db.query(User).filter(User.telegram_id == str(message.from_user.id)).first()
+        async with AsyncSessionLocal() as db:
             if user:
                 new_task = Task(
                     user_id=user.id,
                     name=data['name'],
                     description=data['description'],
                     category=data['category'],
-                    is_completed=0
+                    is_completed=0,
+                    version=await next_version(db, user.id)
                 )
                 db.add(new_task)
-                db.commit()
+                await db.commit()
         await message.answer("Задача успешно создана.")
         await state.clear()
         return
@@ -0,0 +1,62 @@
+"""Приём обновлений Telegram через webhook на том же FastAPI-приложении, что и API."""
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import APIRouter, Header, HTTPException, Request
+
+from server import config
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+class WebhookHandler:
+    """Обрабатывает обновления в фоне, не больше WEBHOOK_CONCURRENCY одновременно.
+
+    Telegram получает ответ сразу после постановки обновления в работу. Когда все места
+    заняты, запрос ждёт свободного места, и Telegram сам притормаживает доставку.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, concurrency: int = None):
+        self.dp = dp
+        self.bot = bot
+        self.slots = asyncio.Semaphore(concurrency or config.WEBHOOK_CONCURRENCY)
+        self.tasks = set()
+
+    async def feed(self, data: dict):
+        update = Update.model_validate(data, context={'bot': self.bot})
+        await self.slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception(f'Failed to process update {update.update_id}')
+        finally:
+            self.slots.release()
+
+    async def start(self):
+        if config.WEBHOOK_URL:
+            await self.bot.set_webhook(config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+                                       secret_token=config.WEBHOOK_SECRET)
+
+    async def close(self):
+        """Дожидается обновлений, которые уже в работе."""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+@router.post(config.WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request,
+                           secret: str = Header(None, alias='X-Telegram-Bot-Api-Secret-Token')):
+    if config.WEBHOOK_SECRET and secret != config.WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Bad secret token")
+    handler: WebhookHandler = request.app.state.webhook
+    await handler.feed(await request.json())
+    return {"ok": True}
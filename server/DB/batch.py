@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+from sqlalchemy import insert, update, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .sync import next_version, add_tombstones
+
+
+async def apply_batch(db: AsyncSession, model, entity: str, user_id: int, operations, prepare=None) -> dict:
+    """Применяет пачку операций create/update/delete одной транзакцией.
+
+    Вместо запроса на каждую операцию выполняется один INSERT на все создания,
+    по одному UPDATE на каждый набор одинаковых изменений и один DELETE на все удаления.
+    Порядок применения: создание, изменение, удаление. Коммит делает вызывающий код.
+    prepare(data) может дополнить поля создаваемой строки.
+    Создание с client_id, уже известным серверу, не вставляет строку, а возвращает id прежней.
+    """
+    results = [None] * len(operations)
+    creates, deletes = [], []
+    updates = defaultdict(list)
+
+    for index, op in enumerate(operations):
+        if op.op == 'create' and op.data is not None:
+            creates.append((index, op.client_id, op.data.model_dump()))
+        elif op.op == 'update' and op.id is not None and op.patch is not None:
+            changes = tuple(sorted(op.patch.model_dump(exclude_unset=True).items()))
+            updates[changes].append((index, op.id))
+        elif op.op == 'delete' and op.id is not None:
+            deletes.append((index, op.id))
+        else:
+            results[index] = {"index": index, "status": "invalid", "id": op.id}
+
+    version = await next_version(db, user_id)
+
+    if creates:
+        client_ids = [client_id for _, client_id, _ in creates if client_id is not None]
+        known = {}
+        if client_ids:
+            known = dict((await db.execute(select(model.client_id, model.id).where(
+                model.user_id == user_id, model.client_id.in_(client_ids)
+            ))).all())
+        fresh, repeats, seen = [], [], set()
+        for index, client_id, data in creates:
+            if client_id in known:
+                results[index] = {"index": index, "status": "created", "id": known[client_id]}
+            elif client_id in seen:
+                repeats.append((index, client_id))
+            else:
+                fresh.append((index, client_id, data))
+                if client_id is not None:
+                    seen.add(client_id)
+
+        rows = [dict(data, user_id=user_id, version=version, client_id=client_id) for _, client_id, data in fresh]
+        if prepare is not None:
+            rows = [dict(row, **prepare(row)) for row in rows]
+        if rows:
+            new_ids = (await db.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows)).all()
+            for (index, client_id, _), new_id in zip(fresh, new_ids):
+                results[index] = {"index": index, "status": "created", "id": new_id}
+                known[client_id] = new_id
+        for index, client_id in repeats:
+            results[index] = {"index": index, "status": "created", "id": known[client_id]}
+
+    for changes, items in updates.items():
+        found = set(await db.scalars(
+            update(model)
+            .where(model.user_id == user_id, model.id.in_([item_id for _, item_id in items]))
+            .values(dict(changes, version=version))
+            .returning(model.id)
+        ))
+        for index, item_id in items:
+            results[index] = {"index": index, "status": "updated" if item_id in found else "not_found", "id": item_id}
+
+    if deletes:
+        found = set(await db.scalars(
+            delete(model)
+            .where(model.user_id == user_id, model.id.in_([item_id for _, item_id in deletes]))
+            .returning(model.id)
+        ))
+        add_tombstones(db, user_id, entity, found, version)
+        for index, item_id in deletes:
+            results[index] = {"index": index, "status": "deleted" if item_id in found else "not_found", "id": item_id}
+
+    return {"results": results, "cursor": version}
@@ -1,8 +1,12 @@
-from DB import engine, Base
+import logging
+
+from server.DB.database import engine
+from server.DB.migrations import run_migrations
 
 
 def create_tables():
-    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
 if __name__ == "__main__":
-    create_tables()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    create_tables()
@@ -0,0 +1,208 @@
+"""Версионные миграции схемы.
+
+Применённые версии хранятся в таблице schema_migrations. Каждая миграция идемпотентна,
+поэтому её можно безопасно выполнить и на новой базе, и на уже работающей.
+Индексы на PostgreSQL строятся через CREATE INDEX CONCURRENTLY, без блокировки записи в таблицу.
+"""
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, bindparam, inspect, select, text
+from sqlalchemy.schema import CreateIndex
+
+from .database import Base
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock, чтобы миграции не запускались параллельно из нескольких воркеров
+MIGRATION_LOCK_ID = 72_101
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def add_column(conn, table, column_name):
+    """Добавляет колонку модели, если её ещё нет в таблице."""
+    if column_name in {c['name'] for c in inspect(conn).get_columns(table.name)}:
+        return
+    column = table.c[column_name]
+    ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}'
+    if column.default is not None and column.default.is_scalar:
+        ddl += f' DEFAULT {int(column.default.arg) if isinstance(column.default.arg, bool) else column.default.arg}'
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    conn.execute(text(ddl))
+
+
+def create_index(conn, index):
+    """Создаёт индекс модели, если его нет; на PostgreSQL — без блокировки таблицы."""
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+    if conn.dialect.name == 'postgresql':
+        ddl = re.sub(r'^CREATE (UNIQUE )?INDEX', r'CREATE \1INDEX CONCURRENTLY', ddl)
+    conn.execute(text(ddl))
+
+
+def drop_index(conn, name):
+    """Удаляет индекс, если он есть; на PostgreSQL — без блокировки таблицы."""
+    concurrently = ' CONCURRENTLY' if conn.dialect.name == 'postgresql' else ''
+    conn.execute(text(f'DROP INDEX{concurrently} IF EXISTS {name}'))
+
+
+def create_table(conn, model):
+    model.__table__.create(conn, checkfirst=True)
+
+
+def model_indexes(model, *names):
+    """Индексы модели по имени: миграция создаёт только свои, а не все, что есть в модели сейчас."""
+    indexes = {index.name: index for index in model.__table__.indexes}
+    return [indexes[name] for name in names]
+
+
+# --- Миграции ---
+
+def initial_schema(conn):
+    Base.metadata.create_all(conn)
+
+
+def delta_sync_columns(conn):
+    add_column(conn, models.User.__table__, 'sync_version')
+    add_column(conn, models.Event.__table__, 'version')
+    add_column(conn, models.Task.__table__, 'version')
+    create_table(conn, models.Tombstone)
+
+
+def hot_query_indexes(conn):
+    conn.execute(text('DROP INDEX IF EXISTS ix_tombstones_user_id'))
+    # ix_events_pending_start отсюда убран: напоминания давно идут по next_fire_at, см. миграцию 14
+    for index in (*model_indexes(models.Event, 'ix_events_user_start_date', 'ix_events_user_version'),
+                  *model_indexes(models.Task, 'ix_tasks_user_category', 'ix_tasks_user_version'),
+                  *model_indexes(models.Tombstone, 'ix_tombstones_user_entity_version')):
+        create_index(conn, index)
+
+
+def reminder_schedule_columns(conn):
+    from server.Scheduler.reminders import reminder_fields
+
+    events = models.Event.__table__
+    add_column(conn, events, 'reminder_stage')
+    add_column(conn, events, 'next_fire_at')
+    # Расписание нужно только событиям, напоминания о которых ещё впереди
+    now = datetime.now()
+    rows = conn.execute(select(events.c.id, events.c.notify_at).where(
+        events.c.notify_at >= now, events.c.next_fire_at.is_(None)
+    )).all()
+    if rows:
+        conn.execute(events.update().where(events.c.id == bindparam('event_id')),
+                     [dict(reminder_fields(notify_at, now), event_id=event_id) for event_id, notify_at in rows])
+
+
+def reminder_schedule_index(conn):
+    create_index(conn, *model_indexes(models.Event, 'ix_events_next_fire'))
+
+
+def delivery_ledger(conn):
+    create_table(conn, models.ReminderDelivery)
+
+
+def user_digest_time(conn):
+    from server.Scheduler.digest import default_digest_time
+
+    users = models.User.__table__
+    add_column(conn, users, 'digest_time')
+    add_column(conn, users, 'last_digest_on')
+    ids = conn.scalars(select(users.c.id).where(users.c.digest_time.is_(None))).all()
+    if ids:
+        conn.execute(users.update().where(users.c.id == bindparam('user_id')),
+                     [{'user_id': user_id, 'digest_time': default_digest_time(user_id)} for user_id in ids])
+
+
+def user_digest_index(conn):
+    create_index(conn, *model_indexes(models.User, 'ix_users_digest_time'))
+
+
+def scheduler_locks(conn):
+    create_table(conn, models.SchedulerLock)
+
+
+def fsm_states(conn):
+    create_table(conn, models.FsmState)
+
+
+def batch_client_ids(conn):
+    add_column(conn, models.Event.__table__, 'client_id')
+    add_column(conn, models.Task.__table__, 'client_id')
+
+
+def batch_client_id_indexes(conn):
+    for index in (*model_indexes(models.Event, 'ux_events_user_client'),
+                  *model_indexes(models.Task, 'ux_tasks_user_client')):
+        create_index(conn, index)
+
+
+def drop_scheduler_state(conn):
+    # Догонять пропущенное помогает состояние самих строк (next_fire_at, журнал, last_digest_on), а не отметка
+    conn.execute(text('DROP TABLE IF EXISTS scheduler_state'))
+
+
+def drop_pending_start_index(conn):
+    # Напоминания выбираются по ix_events_next_fire, а сводки не фильтруют по is_completed
+    drop_index(conn, 'ix_events_pending_start')
+
+
+# (версия, название, функция, выполнять ли в транзакции)
+MIGRATIONS = [
+    (1, 'initial schema', initial_schema, True),
+    (2, 'delta sync columns', delta_sync_columns, True),
+    (3, 'hot query indexes', hot_query_indexes, False),
+    (4, 'reminder schedule columns', reminder_schedule_columns, True),
+    (5, 'reminder schedule index', reminder_schedule_index, False),
+    (6, 'reminder delivery ledger', delivery_ledger, True),
+    (7, 'per-user digest time', user_digest_time, True),
+    (8, 'per-user digest index', user_digest_index, False),
+    (9, 'scheduler locks', scheduler_locks, True),
+    (10, 'bot fsm states', fsm_states, True),
+    (11, 'batch create client ids', batch_client_ids, True),
+    (12, 'batch create client id indexes', batch_client_id_indexes, False),
+    (13, 'drop scheduler watermark', drop_scheduler_state, True),
+    (14, 'drop unused pending start index', drop_pending_start_index, False),
+]
+
+
+def run_migrations(engine):
+    """Применяет все ещё не применённые миграции по порядку."""
+    with engine.connect() as lock_conn:
+        if engine.dialect.name == 'postgresql':
+            lock_conn.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+            lock_conn.commit()
+        try:
+            with engine.begin() as conn:
+                schema_migrations.create(conn, checkfirst=True)
+                applied = set(conn.scalars(select(schema_migrations.c.version)))
+
+            for version, name, apply, transactional in MIGRATIONS:
+                if version in applied:
+                    continue
+                logger.info(f'Applying migration {version}: {name}')
+                if transactional:
+                    with engine.begin() as conn:
+                        apply(conn)
+                        _mark_applied(conn, version, name)
+                else:
+                    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+                    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                        apply(conn)
+                        _mark_applied(conn, version, name)
+        finally:
+            if engine.dialect.name == 'postgresql':
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
+                lock_conn.commit()
+
+
+def _mark_applied(conn, version, name):
+    conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.now()))
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Date, Time
+from sqlalchemy import (Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Date, Time, Index,
+                        UniqueConstraint, text)
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -10,9 +11,18 @@ class User(Base):
     telegram_id = Column(String, unique=True, index=True, nullable=True)
     api_token = Column(String, unique=True, index=True, nullable=True) # Добавлено nullable=True
     link_code = Column(String, unique=True, nullable=True)
+    # Счётчик изменений пользователя, служит курсором для дельта-синхронизации
+    sync_version = Column(Integer, default=0, nullable=False)
+    # Время утренней сводки пользователя и дата последней отправленной сводки
+    digest_time = Column(Time, nullable=True)
+    last_digest_on = Column(Date, nullable=True)
     events = relationship("Event", back_populates="owner")
     tasks = relationship("Task", back_populates="owner")
 
+    __table_args__ = (
+        Index('ix_users_digest_time', 'digest_time'),
+    )
+
 class Event(Base):
     __tablename__ = 'events'
 
@@ -26,8 +36,26 @@ class Event(Base):
     notify_at = Column(DateTime)
     is_sent = Column(Boolean, default=0)
     is_completed = Column(Integer, default=0)
+    version = Column(Integer, default=0, nullable=False)
+    # Расписание напоминаний: номер следующего этапа и время его срабатывания (из notify_at)
+    reminder_stage = Column(Integer, default=0, nullable=False)
+    next_fire_at = Column(DateTime, nullable=True)
+    # Ключ создания от клиента: повтор той же пачки после потерянного ответа не создаёт копию
+    client_id = Column(String(64), nullable=True)
     owner = relationship("User", back_populates="events")
 
+    __table_args__ = (
+        # Просмотр событий пользователя по дням (бот, выбор даты)
+        Index('ix_events_user_start_date', 'user_id', 'start_date'),
+        # Дельта-синхронизация: изменения пользователя после курсора
+        Index('ix_events_user_version', 'user_id', 'version'),
+        # Планировщик: одна диапазонная выборка next_fire_at <= now по неотправленным напоминаниям
+        Index('ix_events_next_fire', 'next_fire_at',
+              postgresql_where=text('NOT is_sent AND is_completed = 0'),
+              sqlite_where=text('NOT is_sent AND is_completed = 0')),
+        Index('ux_events_user_client', 'user_id', 'client_id', unique=True),
+    )
+
 class Task(Base):
     __tablename__ = 'tasks'
 
@@ -37,4 +65,61 @@ class Task(Base):
     description = Column(String, nullable=True)
     category = Column(String, nullable=True)
     is_completed = Column(Boolean, default=False)
-    owner = relationship("User", back_populates="tasks")
\ No newline at end of file
+    version = Column(Integer, default=0, nullable=False)
+    client_id = Column(String(64), nullable=True)
+    owner = relationship("User", back_populates="tasks")
+
+    __table_args__ = (
+        Index('ix_tasks_user_category', 'user_id', 'category'),
+        Index('ix_tasks_user_version', 'user_id', 'version'),
+        Index('ux_tasks_user_client', 'user_id', 'client_id', unique=True),
+    )
+
+class Tombstone(Base):
+    """Запись об удалённой строке, чтобы клиенты узнали об удалении при дельта-синхронизации."""
+    __tablename__ = 'tombstones'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    entity = Column(String, nullable=False)  # 'event' или 'task'
+    entity_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_tombstones_user_entity_version', 'user_id', 'entity', 'version'),
+    )
+
+class ReminderDelivery(Base):
+    """Журнал доставки: одна строка на этап напоминания, повторная вставка того же этапа невозможна."""
+    __tablename__ = 'reminder_deliveries'
+
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, ForeignKey('events.id', ondelete='CASCADE'), nullable=False)
+    stage = Column(Integer, nullable=False)
+    fire_at = Column(DateTime, nullable=False)
+    status = Column(String, nullable=False)  # pending, sent, failed, skipped
+    attempts = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('event_id', 'stage', name='uq_reminder_deliveries_event_stage'),
+        Index('ix_reminder_deliveries_failed', 'status',
+              postgresql_where=text("status = 'failed'"), sqlite_where=text("status = 'failed'")),
+    )
+
+class SchedulerLock(Base):
+    """Аренда роли ведущего планировщика: действует до expires_at, пока владелец её продлевает."""
+    __tablename__ = 'scheduler_locks'
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class FsmState(Base):
+    """Состояние диалога бота (aiogram FSM). Брошенные диалоги удаляются по updated_at."""
+    __tablename__ = 'fsm_states'
+
+    key = Column(String, primary_key=True)  # бот:чат:пользователь:тред:бизнес-подключение:destiny
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=False, default='{}')  # JSON
+    updated_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,40 @@
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Task
+
+
+async def task_summary(db: AsyncSession, user_id: int, completed: bool = None, search: str = None,
+                       per_category: int = 10) -> list[dict]:
+    """Задачи пользователя по категориям одним запросом.
+
+    Для каждой категории возвращаются число подходящих задач, сколько из них выполнено,
+    и первые per_category задач (сначала невыполненные). Группировка и отбор делаются
+    оконными функциями в БД, поэтому большие списки не передаются целиком.
+    """
+    query = select(
+        Task,
+        func.row_number().over(partition_by=Task.category, order_by=(Task.is_completed, Task.id)).label('rank'),
+        func.count().over(partition_by=Task.category).label('total'),
+        func.sum(case((Task.is_completed, 1), else_=0)).over(partition_by=Task.category).label('done'),
+    ).where(Task.user_id == user_id)
+    if completed is not None:
+        query = query.where(Task.is_completed == completed)
+    if search:
+        query = query.where(Task.name.icontains(search, autoescape=True)
+                            | Task.description.icontains(search, autoescape=True))
+
+    ranked = query.subquery()
+    task = ranked.c
+    rows = await db.execute(
+        select(ranked).where(task.rank <= per_category).order_by(task.category, task.rank)
+    )
+
+    summary = {}
+    for row in rows.mappings():
+        group = summary.get(row['category'])
+        if group is None:
+            group = summary[row['category']] = {"category": row['category'], "total": row['total'],
+                                                "completed": int(row['done'] or 0), "items": []}
+        group["items"].append({column.name: row[column.name] for column in Task.__table__.columns})
+    return list(summary.values())
@@ -0,0 +1,62 @@
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import User, Tombstone
+
+EVENT = 'event'
+TASK = 'task'
+
+
+async def next_version(db: AsyncSession, user_id: int) -> int:
+    """Увеличивает счётчик изменений пользователя и возвращает новую версию.
+
+    Вызывается один раз на транзакцию: все строки, изменённые в ней, получают одну версию.
+    Обновление строки пользователя блокирует её до коммита, поэтому версии одного
+    пользователя фиксируются строго по порядку.
+    """
+    return (await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(sync_version=User.sync_version + 1)
+        .returning(User.sync_version)
+    )).scalar_one()
+
+
+def add_tombstones(db: AsyncSession, user_id: int, entity: str, ids, version: int):
+    db.add_all([Tombstone(user_id=user_id, entity=entity, entity_id=i, version=version) for i in ids])
+
+
+def keyset_page(query, model, after_id=None, limit=None):
+    """Keyset-пагинация по id: страница строк с id > after_id, не больше limit."""
+    query = query.order_by(model.id)
+    if after_id is not None:
+        query = query.where(model.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+async def changes_since(db: AsyncSession, model, entity: str, user_id: int, since: int,
+                        after_id=None, limit=None) -> dict:
+    """Возвращает строки, изменённые после курсора since, id удалённых строк и новый курсор.
+
+    since=0 означает первую синхронизацию: отдаются все строки без надгробий.
+    Большую дельту можно забирать страницами через after_id/limit с тем же since,
+    удалённые id приходят только на первой странице.
+    """
+    # Курсор читаем до выборки строк: изменение, попавшее между запросами,
+    # придёт ещё раз при следующей синхронизации, но не потеряется
+    cursor = await db.scalar(select(User.sync_version).where(User.id == user_id)) or 0
+
+    query = select(model).where(model.user_id == user_id)
+    deleted = []
+    if since > 0:
+        query = query.where(model.version > since)
+    if since > 0 and after_id is None:
+        deleted = list(await db.scalars(select(Tombstone.entity_id).where(
+            Tombstone.user_id == user_id,
+            Tombstone.entity == entity,
+            Tombstone.version > since
+        )))
+    items = (await db.scalars(keyset_page(query, model, after_id, limit))).all()
+    return {"items": items, "deleted": deleted, "cursor": cursor}
@@ -1,61 +1,117 @@
 import uuid
-from typing import Annotated, List
+from typing import Annotated, List, NamedTuple, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Header
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from server.DB.database import get_db
+from server.DB.database import get_async_db, AsyncSessionLocal
 from server.DB.models import Event, User, Task
-from .schemas import EventCreate, LinkCode, TaskCreate, EventResponse, EventUpdate, TaskResponse, TaskUpdate
+from server.DB.sync import EVENT, TASK, next_version, add_tombstones, changes_since, keyset_page
+from server.DB.batch import apply_batch
+from server.DB.summary import task_summary
+from server.cache import make_cache
+from server.Scheduler.reminders import reminder_fields
+from .schemas import (EventCreate, LinkCode, TaskCreate, EventResponse, EventUpdate, TaskResponse, TaskUpdate,
+                      EventDelta, TaskDelta, EventBatch, TaskBatch, BatchResult, TaskCategorySummary)
 
 router = APIRouter()
 
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
 
-def get_current_user(
-        db: Session = Depends(get_db),
+# Кэш токен -> пользователь, чтобы авторизация не стоила запроса к БД на каждый вызов API
+token_cache = make_cache('token:', maxsize=10000, ttl=300)
+
+
+class CurrentUser(NamedTuple):
+    id: int
+    telegram_id: Optional[str]
+
+
+async def get_current_user(
+        db: AsyncSession = Depends(get_async_db),
         authorization: Annotated[str, Header(alias='Authorization')] = None
-):
+) -> CurrentUser:
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing Authorization header")
 
     token = authorization.split(" ")[1] if authorization.startswith("Bearer ") else authorization
-    user = db.query(User).filter(User.api_token == token).first()
+    cached = await token_cache.get(token)
+    if cached is not None:
+        return CurrentUser(*cached)
+
+    user = await db.scalar(select(User).where(User.api_token == token))
 
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
-    return user
+    current_user = CurrentUser(user.id, user.telegram_id)
+    await token_cache.set(token, current_user)
+    return current_user
 
 
 AuthenticatedUser = Depends(get_current_user)
+PageLimit = Query(None, ge=1, le=MAX_PAGE_SIZE)
+
+
+def stream_ndjson(model, schema, user_id: int, after_id=None, limit=None):
+    """Отдаёт строки пользователя построчно в NDJSON, читая их серверным курсором пачками.
+
+    У генератора своя сессия: он работает уже после выхода из обработчика.
+    """
+
+    async def rows():
+        async with AsyncSessionLocal() as db:
+            query = keyset_page(select(model).where(model.user_id == user_id), model, after_id, limit)
+            async for row in await db.stream_scalars(query.execution_options(yield_per=STREAM_BATCH_SIZE)):
+                yield schema.model_validate(row).model_dump_json() + "\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
 
 
 @router.post("/auth/link")
-def link_device(link_data: LinkCode, db: Session = Depends(get_db)):
+async def link_device(link_data: LinkCode, db: AsyncSession = Depends(get_async_db)):
     """Обмен временного кода из бота на постоянный API токен."""
-    user = db.query(User).filter(User.link_code == link_data.code).first()
+    user = await db.scalar(select(User).where(User.link_code == link_data.code))
     if not user:
         raise HTTPException(status_code=404, detail="Код не найден")
 
     new_token = str(uuid.uuid4())
+    if user.api_token:
+        await token_cache.pop(user.api_token)  # Старый токен больше не действует
     user.api_token = new_token
     user.link_code = None  # Сбрасываем код после использования
-    db.commit()
+    await db.commit()
     return {"status": "success", "api_token": new_token}
 
 
-@router.get("/events", response_model=List[EventResponse])
-def get_events(
-        current_user: User = AuthenticatedUser,
-        db: Session = Depends(get_db)
+@router.get("/events", response_model=Union[List[EventResponse], EventDelta])
+async def get_events(
+        since: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = PageLimit,
+        stream: bool = False,
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
 ):
-    return db.query(Event).filter(Event.user_id == current_user.id).all()
+    """Список событий. С параметром since возвращает только изменения после курсора.
+
+    after_id/limit — keyset-пагинация по id, stream=true — полный список в NDJSON.
+    """
+    if stream:
+        return stream_ndjson(Event, EventResponse, current_user.id, after_id, limit)
+    if since is not None:
+        return await changes_since(db, Event, EVENT, current_user.id, since, after_id, limit)
+    return (await db.scalars(keyset_page(select(Event).where(Event.user_id == current_user.id),
+                                         Event, after_id, limit))).all()
 
 
 @router.post("/events")
-def create_event(
+async def create_event(
         event_data: EventCreate,
-        current_user: User = AuthenticatedUser,
-        db: Session = Depends(get_db)
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
 ):
     """Создание события с привязкой к пользователю."""
     new_event = Event(
@@ -66,122 +122,178 @@ def create_event(
         time_start=event_data.time_start,
         time_end=event_data.time_end,
         notify_at=event_data.notify_at,
-        is_completed=event_data.is_completed
+        is_completed=event_data.is_completed,
+        version=await next_version(db, current_user.id),
+        **reminder_fields(event_data.notify_at)
     )
     db.add(new_event)
-    db.commit()
-    db.refresh(new_event)
+    await db.commit()
     return {"status": "success", "id": new_event.id}
 
 
 @router.patch('/events/{event_id}')
-def update_event(
+async def update_event(
         event_id: int,
         update_data: EventUpdate,
-        current_user: User = AuthenticatedUser,
-        db: Session = Depends(get_db)
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
 ):
-    event = db.query(Event).filter(Event.id == event_id, Event.user_id == current_user.id).first()
+    event = await db.scalar(select(Event).where(Event.id == event_id, Event.user_id == current_user.id))
     if not event:
         raise HTTPException(status_code=404, detail="Событие не найдено")
 
     for key, value in update_data.model_dump(exclude_unset=True).items():
         setattr(event, key, value)
+    event.version = await next_version(db, current_user.id)
 
-    db.commit()
+    await db.commit()
     return {"status": "success"}
 
 
 @router.delete("/events/{event_id}")
-def delete_event(
+async def delete_event(
         event_id: str,
-        current_user: User = AuthenticatedUser,
-        db: Session = Depends(get_db)
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
 ):
     """Удаление события по ID сервера."""
     if '_' in event_id:
-        ids = event_id.split('_')
-        for event_id in ids:
-            ev_id = int(event_id)
-            event = db.query(Event).filter(Event.id == ev_id, Event.user_id == current_user.id).first()
-            if not event:
-                raise HTTPException(status_code=404, detail="Событие не найдено")
-            db.delete(event)
-            db.commit()
+        ids = {int(ev_id) for ev_id in event_id.split('_')}
+        # Один DELETE на все id; если хотя бы одного события нет — ничего не удаляем
+        deleted = set(await db.scalars(
+            delete(Event).where(Event.id.in_(ids), Event.user_id == current_user.id).returning(Event.id)
+        ))
+        if deleted != ids:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Событие не найдено")
+        add_tombstones(db, current_user.id, EVENT, deleted, await next_version(db, current_user.id))
+        await db.commit()
         return {"status": "success"}
     else:
-        event = db.query(Event).filter(Event.id == event_id, Event.user_id == current_user.id).first()
+        event = await db.scalar(select(Event).where(Event.id == int(event_id), Event.user_id == current_user.id))
         if not event:
             raise HTTPException(status_code=404, detail="Событие не найдено")
 
-        db.delete(event)
-        db.commit()
+        await db.delete(event)
+        add_tombstones(db, current_user.id, EVENT, [event.id], await next_version(db, current_user.id))
+        await db.commit()
         return {"status": "success"}
 
 
-@router.get("/tasks", response_model=List[TaskResponse])
-def get_tasks(
-        current_user: User = AuthenticatedUser,
-        db: Session = Depends(get_db)
+@router.post("/events:batch", response_model=BatchResult)
+async def batch_events(
+        batch: EventBatch,
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
+):
+    """Пакетное создание, изменение и удаление событий за один запрос и одну транзакцию."""
+    result = await apply_batch(db, Event, EVENT, current_user.id, batch.operations,
+                               prepare=lambda row: reminder_fields(row['notify_at']))
+    await db.commit()
+    return result
+
+
+@router.get("/tasks", response_model=Union[List[TaskResponse], TaskDelta])
+async def get_tasks(
+        since: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = PageLimit,
+        stream: bool = False,
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
 ):
-    return db.query(Task).filter(Task.user_id == current_user.id).all()
+    if stream:
+        return stream_ndjson(Task, TaskResponse, current_user.id, after_id, limit)
+    if since is not None:
+        return await changes_since(db, Task, TASK, current_user.id, since, after_id, limit)
+    return (await db.scalars(keyset_page(select(Task).where(Task.user_id == current_user.id),
+                                         Task, after_id, limit))).all()
+
+
+@router.get("/tasks/summary", response_model=List[TaskCategorySummary])
+async def get_task_summary(
+        completed: Optional[bool] = None,
+        q: Optional[str] = Query(None, max_length=200),
+        limit: int = Query(10, ge=1, le=100),
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
+):
+    """Задачи по категориям: количество и первые limit задач каждой категории, с фильтром по статусу и тексту."""
+    return await task_summary(db, current_user.id, completed=completed, search=q, per_category=limit)
 
 
 @router.post("/tasks")
-def create_task(
+async def create_task(
         task_data: TaskCreate,
-        current_user: User = AuthenticatedUser,
-        db: Session = Depends(get_db)
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
 ):
     new_task = Task(
         user_id=current_user.id,
         name=task_data.name,
         description=task_data.description,
         category=task_data.category,
-        is_completed=task_data.is_completed
+        is_completed=task_data.is_completed,
+        version=await next_version(db, current_user.id)
     )
     db.add(new_task)
-    db.commit()
+    await db.commit()
     return {"status": "success", "id": new_task.id}
 
 
 @router.patch('/tasks/{task_id}')
-def update_task(
+async def update_task(
         task_id: int,
         update_data: TaskUpdate,
-        current_user: User = AuthenticatedUser,
-        db: Session = Depends(get_db)
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
 ):
-    task = db.query(Task).filter(Task.id == task_id, Task.user_id == current_user.id).first()
+    task = await db.scalar(select(Task).where(Task.id == task_id, Task.user_id == current_user.id))
     if not task:
         raise HTTPException(status_code=404, detail="Задача не найдена")
 
     for key, value in update_data.model_dump(exclude_unset=True).items():
         setattr(task, key, value)
+    task.version = await next_version(db, current_user.id)
 
-    db.commit()
+    await db.commit()
     return {"status": "success"}
 
 
 @router.delete("/tasks/{task_id}")
-def delete_task(
+async def delete_task(
         task_id: str,
-        current_user: User = AuthenticatedUser,
-        db: Session = Depends(get_db)
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
 ):
     cats = {'UaI': 'Срочно и важно', 'IbnN': 'Важно, но не срочно', 'UbnI': 'Срочно, но не важно',
             'NUanI': 'Не срочно и не важно'}
     if task_id.isdigit():
         task_id = int(task_id)
-        task = db.query(Task).filter(Task.id == task_id, Task.user_id == current_user.id).first()
+        task = await db.scalar(select(Task).where(Task.id == task_id, Task.user_id == current_user.id))
         if not task:
             raise HTTPException(status_code=404, detail="Задача не найдена")
 
-        db.delete(task)
-        db.commit()
+        await db.delete(task)
+        add_tombstones(db, current_user.id, TASK, [task.id], await next_version(db, current_user.id))
+        await db.commit()
         return {"status": "success"}
     else:
         cat = cats[task_id]
-        db.query(Task).filter(Task.category == cat, Task.user_id == current_user.id).delete()
-        db.commit()
+        ids = list(await db.scalars(
+            delete(Task).where(Task.category == cat, Task.user_id == current_user.id).returning(Task.id)
+        ))
+        add_tombstones(db, current_user.id, TASK, ids, await next_version(db, current_user.id))
+        await db.commit()
         return {"status": "success"}
+
+
+@router.post("/tasks:batch", response_model=BatchResult)
+async def batch_tasks(
+        batch: TaskBatch,
+        current_user: CurrentUser = AuthenticatedUser,
+        db: AsyncSession = Depends(get_async_db)
+):
+    result = await apply_batch(db, Task, TASK, current_user.id, batch.operations)
+    await db.commit()
+    return result
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from datetime import datetime, date, time
 
 
@@ -46,3 +46,60 @@ class TaskResponse(TaskCreate):
 
 class TaskUpdate(BaseModel):
     is_completed: Optional[int] = None
+
+
+class EventDelta(BaseModel):
+    items: List[EventResponse]
+    deleted: List[int]
+    cursor: int
+
+
+class TaskDelta(BaseModel):
+    items: List[TaskResponse]
+    deleted: List[int]
+    cursor: int
+
+
+class TaskCategorySummary(BaseModel):
+    category: Optional[str]
+    total: int  # задач категории, подходящих под фильтр
+    completed: int
+    items: List[TaskResponse]  # первые задачи категории, не больше limit
+
+
+MAX_BATCH_SIZE = 500
+
+
+class EventBatchItem(BaseModel):
+    op: Literal['create', 'update', 'delete']
+    id: Optional[int] = None  # для update и delete
+    client_id: Optional[str] = Field(None, max_length=64)  # для create: повтор с тем же ключом не создаёт копию
+    data: Optional[EventCreate] = None  # для create
+    patch: Optional[EventUpdate] = None  # для update
+
+
+class EventBatch(BaseModel):
+    operations: List[EventBatchItem] = Field(max_length=MAX_BATCH_SIZE)
+
+
+class TaskBatchItem(BaseModel):
+    op: Literal['create', 'update', 'delete']
+    id: Optional[int] = None
+    client_id: Optional[str] = Field(None, max_length=64)
+    data: Optional[TaskCreate] = None
+    patch: Optional[TaskUpdate] = None
+
+
+class TaskBatch(BaseModel):
+    operations: List[TaskBatchItem] = Field(max_length=MAX_BATCH_SIZE)
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: Literal['created', 'updated', 'deleted', 'not_found', 'invalid']
+    id: Optional[int] = None
+
+
+class BatchResult(BaseModel):
+    results: List[BatchItemResult]
+    cursor: int
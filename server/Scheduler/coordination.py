@@ -0,0 +1,106 @@
+"""Согласование нескольких процессов планировщика, чтобы каждое напоминание уходило один раз."""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+
+from server import config
+from server.DB.database import AsyncSessionLocal
+from server.DB.models import SchedulerLock
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = 'reminders'
+
+
+class LeaderLease:
+    """Аренда строки в scheduler_locks.
+
+    Ведущий продлевает аренду на каждой проверке и, через hold(), всё время отправки: проверка может идти
+    дольше SCHEDULER_LEASE_SECONDS. Если он упал, через SCHEDULER_LEASE_SECONDS роль забирает первый процесс,
+    чья проверка пришлась на истёкшую аренду.
+    """
+
+    def __init__(self, name: str = LOCK_NAME):
+        self.name = name
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.is_leader = False
+        self.expires_at = datetime.min
+
+    async def acquire(self) -> bool:
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=config.SCHEDULER_LEASE_SECONDS)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(SchedulerLock)
+                .where(SchedulerLock.name == self.name,
+                       or_(SchedulerLock.owner == self.owner, SchedulerLock.expires_at < now))
+                .values(owner=self.owner, expires_at=expires_at)
+            )
+            acquired = result.rowcount == 1
+            if not acquired:
+                db.add(SchedulerLock(name=self.name, owner=self.owner, expires_at=expires_at))
+                try:
+                    await db.flush()
+                    acquired = True
+                except IntegrityError:
+                    await db.rollback()
+            if acquired:
+                await db.commit()
+
+        if acquired != self.is_leader:
+            logger.info(f"Scheduler {self.owner} {'became' if acquired else 'is no longer'} leader")
+        self.is_leader = acquired
+        if acquired:
+            self.expires_at = expires_at
+        return acquired
+
+    async def hold(self):
+        """Продлевает аренду каждую треть срока, пока задачу не отменят или роль не перейдёт другому."""
+        while self.is_leader:
+            await asyncio.sleep(config.SCHEDULER_LEASE_SECONDS / 3)
+            try:
+                await self.acquire()
+            except Exception as e:
+                # Аренда ещё действует до expires_at, holds_lease() перестанет пускать дальше сам
+                logger.error(f"Scheduler lease renewal error: {e}")
+
+    async def release(self):
+        if not self.is_leader:
+            return
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(SchedulerLock)
+                             .where(SchedulerLock.name == self.name, SchedulerLock.owner == self.owner)
+                             .values(expires_at=datetime.min))
+            await db.commit()
+        self.is_leader = False
+        self.expires_at = datetime.min
+
+
+lease = LeaderLease()
+
+
+async def should_run() -> bool:
+    """Выполнять ли этому процессу очередную проверку."""
+    if config.SCHEDULER_MODE == 'leader':
+        return await lease.acquire()
+    return True
+
+
+def holds_lease() -> bool:
+    """Можно ли забирать следующую пачку работы: в режиме leader — только пока аренда наша и не истекла."""
+    if config.SCHEDULER_MODE == 'leader':
+        return lease.is_leader and datetime.now() < lease.expires_at
+    return True
+
+
+def partition_clause(user_id_column):
+    """Условие доли пользователей этого процесса в режиме partition (пустой список в остальных режимах)."""
+    if config.SCHEDULER_MODE != 'partition' or config.SCHEDULER_PARTITIONS <= 1:
+        return []
+    return [user_id_column % config.SCHEDULER_PARTITIONS == config.SCHEDULER_PARTITION]
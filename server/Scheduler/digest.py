@@ -0,0 +1,72 @@
+import logging
+from datetime import datetime, timedelta, time
+
+from sqlalchemy import select, update, func, or_
+
+from server import config
+from server.DB.database import AsyncSessionLocal
+from server.DB.models import User, Event
+from .coordination import holds_lease, partition_clause
+from .sender import Outgoing
+
+logger = logging.getLogger(__name__)
+
+
+def default_digest_time(user_id: int) -> time:
+    """Время сводки по умолчанию: DIGEST_TIME плюс сдвиг по id, чтобы пик в начале часа размазывался."""
+    base = datetime.strptime(config.DIGEST_TIME, '%H:%M')
+    return (base + timedelta(minutes=user_id % max(config.DIGEST_SPREAD_MINUTES, 1))).time()
+
+
+def due_digests(now: datetime, max_delay: timedelta):
+    """Один групповой запрос: события на сегодня по каждому пользователю, чья сводка уже наступила."""
+    today = now.date()
+    earliest = (now - max_delay).time() if (now - max_delay).date() == today else time.min
+    return (
+        select(User.id, User.telegram_id, func.aggregate_strings(Event.event_name, '\n'))
+        .join(Event, Event.user_id == User.id)
+        .where(
+            Event.start_date == today,
+            User.telegram_id.is_not(None),
+            User.digest_time <= now.time(),
+            User.digest_time >= earliest,
+            or_(User.last_digest_on.is_(None), User.last_digest_on < today),
+            *partition_clause(User.id),
+        )
+        .group_by(User.id, User.telegram_id)
+        .order_by(User.id)
+        .limit(config.DIGEST_CHUNK_SIZE)
+    )
+
+
+async def digest_messages(now: datetime, max_delay: timedelta):
+    """Выдаёт сводки пачками по DIGEST_CHUNK_SIZE пользователей.
+
+    Каждая пачка отмечается отправленной (last_digest_on) в своей короткой транзакции
+    до отправки, поэтому сводка не уходит дважды и соединение не держится на время отправки.
+    Отметка условная: сводку отправляет только тот процесс, чей UPDATE её действительно изменил.
+    """
+    while holds_lease():
+        async with AsyncSessionLocal() as db:
+            try:
+                rows = (await db.execute(due_digests(now, max_delay))).all()
+                if not rows:
+                    return
+                claimed = set(await db.scalars(
+                    update(User)
+                    .where(User.id.in_([user_id for user_id, _, _ in rows]),
+                           or_(User.last_digest_on.is_(None), User.last_digest_on < now.date()))
+                    .values(last_digest_on=now.date())
+                    .returning(User.id)
+                ))
+                await db.commit()
+            except Exception as e:
+                # Непомеченные сводки уйдут на следующей проверке, уже выданные сообщения отправятся
+                logger.error(f"Digest error: {e}")
+                await db.rollback()
+                return
+        for user_id, chat_id, names in rows:
+            if user_id in claimed:
+                yield Outgoing(chat_id, f"⏰ Напоминания на день:\n {names}")
+        if len(rows) < config.DIGEST_CHUNK_SIZE:
+            return
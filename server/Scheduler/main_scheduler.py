@@ -0,0 +1,38 @@
+"""Планировщик напоминаний отдельным процессом. Бот здесь нужен только для отправки, поллинга нет."""
+import asyncio
+import logging
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from server import config
+from server.Bot.main_bot import create_bot
+from server.DB.database import engine
+from server.DB.migrations import run_migrations
+from server.Scheduler.coordination import lease
+from server.Scheduler.reminders import check_events
+
+logger = logging.getLogger(__name__)
+
+
+def create_scheduler(bot) -> AsyncIOScheduler:
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(check_events, 'interval', seconds=config.SCHEDULER_INTERVAL, args=[bot], id='check_events')
+    return scheduler
+
+
+async def main():
+    run_migrations(engine)
+    bot = create_bot()
+    scheduler = create_scheduler(bot)
+    scheduler.start()
+    try:
+        await asyncio.Event().wait()  # работаем, пока процесс не остановят
+    finally:
+        scheduler.shutdown()
+        await lease.release()
+        await bot.session.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
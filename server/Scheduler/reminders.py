@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from server import config
+from server.DB.database import AsyncSessionLocal
+from server.DB.models import User, Event, ReminderDelivery
+from .coordination import lease, should_run, holds_lease, partition_clause
+from .digest import digest_messages
+from .sender import Outgoing, SendPipeline
+
+logger = logging.getLogger(__name__)
+
+MAX_DELAY = timedelta(minutes=config.REMINDER_MAX_DELAY_MINUTES)
+
+# Этапы напоминаний по убыванию упреждения: этап 0 — самое раннее напоминание
+LEAD_TIMES = [timedelta(minutes=m) for m in sorted(set(config.REMINDER_LEAD_MINUTES), reverse=True)]
+
+
+def next_stage(notify_at: datetime, stage: int, now: datetime):
+    """Первый этап, начиная со stage, время которого ещё не прошло: (этап, время срабатывания).
+
+    Если все этапы в прошлом, возвращает (len(LEAD_TIMES), None).
+    """
+    for number in range(stage, len(LEAD_TIMES)):
+        fire_at = notify_at - LEAD_TIMES[number]
+        if fire_at >= now:
+            return number, fire_at
+    return len(LEAD_TIMES), None
+
+
+def reminder_fields(notify_at: datetime, now: datetime = None) -> dict:
+    """Поля расписания напоминаний для нового или перенесённого события."""
+    if notify_at is None:
+        return {"reminder_stage": len(LEAD_TIMES), "next_fire_at": None, "is_sent": True}
+    stage, fire_at = next_stage(notify_at, 0, (now or datetime.now()).replace(second=0, microsecond=0))
+    return {"reminder_stage": stage, "next_fire_at": fire_at, "is_sent": fire_at is None}
+
+
+def due_reminders(now: datetime):
+    """Один диапазонный запрос по частичному индексу: всё, что пора отправить, вместе с чатом владельца."""
+    return select(Event, User.telegram_id).join(User, User.id == Event.user_id).where(
+        Event.next_fire_at <= now,
+        Event.is_sent == False,
+        Event.is_completed == 0,
+        *partition_clause(Event.user_id),
+    ).order_by(Event.next_fire_at).limit(config.REMINDER_BATCH_SIZE).with_for_update(skip_locked=True, of=Event)
+
+
+async def claim_due(db, now: datetime, retries: bool = True):
+    """Заносит пачку наступивших напоминаний в журнал и сдвигает их расписание.
+
+    Возвращает список (запись журнала, чат, текст) к отправке, с retries — включая повторы после ошибок,
+    и признак того, что пачка полная и наступившие напоминания могут ещё остаться.
+    Этапы, уже записанные в журнал, повторно не отправляются.
+    """
+    rows = (await db.execute(due_reminders(now))).all()
+    claimed = set()
+    if rows:
+        claimed = set((await db.execute(select(ReminderDelivery.event_id, ReminderDelivery.stage).where(
+            ReminderDelivery.event_id.in_([event.id for event, _ in rows])
+        ))).all())
+
+    jobs = []
+    for event, chat_id in rows:
+        if (event.id, event.reminder_stage) not in claimed:
+            skip = not chat_id or now - event.next_fire_at > MAX_DELAY
+            delivery = ReminderDelivery(event_id=event.id, stage=event.reminder_stage, fire_at=event.next_fire_at,
+                                        status='skipped' if skip else 'pending', attempts=0, updated_at=now)
+            db.add(delivery)
+            if not skip:
+                jobs.append((delivery, chat_id, f"⏰ Напоминание: {event.event_name}"))
+
+        # Переходим к следующему этапу; пропущенные за время простоя этапы не дублируем
+        stage, fire_at = next_stage(event.notify_at, event.reminder_stage + 1, now + timedelta(minutes=1))
+        event.reminder_stage = stage
+        event.next_fire_at = fire_at
+        event.is_sent = fire_at is None
+
+    if not retries:
+        return jobs, len(rows) == config.REMINDER_BATCH_SIZE
+    failed = (await db.execute(
+        select(ReminderDelivery, Event.event_name, User.telegram_id)
+        .join(Event, Event.id == ReminderDelivery.event_id)
+        .join(User, User.id == Event.user_id)
+        .where(
+            ReminderDelivery.status == 'failed',
+            ReminderDelivery.attempts < config.REMINDER_MAX_ATTEMPTS,
+            ReminderDelivery.fire_at >= now - MAX_DELAY,
+            *partition_clause(Event.user_id),
+        )
+        # Повтор забирает тот, кто первым заблокировал строку; второй процесс её пропускает
+        .with_for_update(skip_locked=True, of=ReminderDelivery)
+    )).all()
+    for delivery, event_name, chat_id in failed:
+        delivery.status = 'pending'
+        jobs.append((delivery, chat_id, f"⏰ Напоминание: {event_name}"))
+    return jobs, len(rows) == config.REMINDER_BATCH_SIZE
+
+
+async def record_results(results):
+    """Записывает исход пачки отправок в журнал коротким отдельным запросом."""
+    sent = [m.delivery_id for m, ok in results if ok and m.delivery_id is not None]
+    failed = [m.delivery_id for m, ok in results if not ok and m.delivery_id is not None]
+    if not sent and not failed:
+        return
+    now = datetime.now()
+    async with AsyncSessionLocal() as db:
+        if sent:
+            await db.execute(update(ReminderDelivery).where(ReminderDelivery.id.in_(sent))
+                             .values(status='sent', updated_at=now))
+        if failed:
+            await db.execute(update(ReminderDelivery).where(ReminderDelivery.id.in_(failed))
+                             .values(status='failed', attempts=ReminderDelivery.attempts + 1, updated_at=now))
+        await db.commit()
+
+
+async def reminder_messages(now: datetime):
+    """Выдаёт наступившие напоминания пачками по REMINDER_BATCH_SIZE, пока они не кончатся.
+
+    Как и сводки, каждая пачка фиксируется в своей короткой транзакции до отправки,
+    поэтому пик в начале часа уходит за одну проверку, а не по пачке в минуту.
+    """
+    retries = True
+    while holds_lease():
+        async with AsyncSessionLocal() as db:
+            try:
+                jobs, more = await claim_due(db, now, retries)
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Scheduler error: {e}")
+                await db.rollback()
+                return
+            messages = [Outgoing(chat_id, text, delivery.id) for delivery, chat_id, text in jobs]
+        for message in messages:
+            yield message
+        if not more:
+            return
+        retries = False
+
+
+async def check_events(bot):
+    """Проверка напоминаний.
+
+    Сначала отдельной транзакцией фиксируются журнал и новое расписание, и только потом идёт отправка.
+    Выборка берёт всё, у чего next_fire_at уже наступило, поэтому опоздавшая проверка или перезапуск
+    досылают пропущенное (не старше REMINDER_MAX_DELAY_MINUTES), но ничего не отправляют дважды: напоминание,
+    прерванное на середине отправки, остаётся в статусе pending и не повторяется.
+    Во время отправки соединение с БД не удерживается.
+    """
+    if not await should_run():
+        return
+    now_check = datetime.now().replace(second=0, microsecond=0)
+
+    async def messages():
+        async for reminder in reminder_messages(now_check):
+            yield reminder
+        async for digest in digest_messages(now_check, MAX_DELAY):
+            yield digest
+
+    pipeline = SendPipeline(bot, on_batch=record_results)
+    renewal = asyncio.create_task(lease.hold()) if config.SCHEDULER_MODE == 'leader' else None
+    try:
+        await pipeline.run(messages())
+    finally:
+        if renewal is not None:
+            renewal.cancel()
+    if pipeline.sent or pipeline.failed:
+        logger.info(f"Reminders: sent {pipeline.sent}, failed {pipeline.failed}")
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from server import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Outgoing:
+    chat_id: str
+    text: str
+    delivery_id: Optional[int] = None  # строка журнала доставки, если сообщение — напоминание
+
+
+class RateLimiter:
+    """Равномерно распределяет отправки: не чаще rate в секунду."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+class SendPipeline:
+    """Параллельная отправка сообщений в Telegram с учётом лимитов.
+
+    Сообщения раздаются пулу воркеров через ограниченную очередь. Общий лимит бота
+    и интервал между сообщениями в один чат соблюдаются, на 429 воркер ждёт retry_after
+    и приостанавливает общий лимит, на сетевые ошибки — повторяет с экспоненциальной паузой.
+    Результаты копятся и передаются в on_batch пачками, чтобы не держать соединение с БД во время отправки.
+    """
+
+    def __init__(self, bot, on_batch=None):
+        self.bot = bot
+        self.on_batch = on_batch
+        self.workers = config.SEND_WORKERS
+        self.limiter = RateLimiter(config.TELEGRAM_GLOBAL_RATE)
+        self.chat_interval = config.TELEGRAM_CHAT_INTERVAL
+        self._chat_next = {}
+        self._results = []
+        self.sent = 0
+        self.failed = 0
+
+    async def _wait_chat(self, chat_id):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _send(self, message: Outgoing) -> bool:
+        await self._wait_chat(message.chat_id)
+        for attempt in range(config.SEND_MAX_RETRIES + 1):
+            await self.limiter.wait()
+            try:
+                await self.bot.send_message(chat_id=message.chat_id, text=message.text)
+                return True
+            except TelegramRetryAfter as e:
+                self.limiter.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Пользователь заблокировал бота или чат не существует — повторять бессмысленно
+                logger.error(f"TG Error: {e}")
+                return False
+            except Exception as e:
+                logger.error(f"TG Error: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+        return False
+
+    async def _flush(self):
+        results, self._results = self._results, []
+        if results and self.on_batch is not None:
+            await self.on_batch(results)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            message = await queue.get()
+            try:
+                ok = await self._send(message)
+                self.sent += ok
+                self.failed += not ok
+                self._results.append((message, ok))
+                if len(self._results) >= config.SEND_COMMIT_EVERY:
+                    await self._flush()
+            except Exception as e:
+                logger.error(f"Send pipeline error: {e}")
+            finally:
+                queue.task_done()
+
+    async def run(self, messages):
+        """Отправляет сообщения из обычного или асинхронного итерируемого объекта.
+
+        Ошибка источника пробрасывается только после отправки всего, что он успел выдать.
+        """
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        try:
+            try:
+                if hasattr(messages, '__aiter__'):
+                    async for message in messages:
+                        await queue.put(message)
+                else:
+                    for message in messages:
+                        await queue.put(message)
+            except Exception:
+                # Источник упал: уже полученные сообщения (напоминания в журнале как pending) всё равно отправляем
+                await queue.join()
+                raise
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._flush()
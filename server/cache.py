@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from server import config
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:  # Общий кэш необязателен, без redis работает кэш в памяти процесса
+    aioredis = None
+
+
+class TTLCache:
+    """Кэш в памяти процесса с временем жизни записей и вытеснением давно неиспользуемых (LRU)."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryCache:
+    """Кэш make_cache без redis: TTLCache процесса за тем же асинхронным интерфейсом, что и RedisCache."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self._cache = TTLCache(maxsize, ttl)
+
+    async def get(self, key, default=None):
+        return self._cache.get(key, default)
+
+    async def set(self, key, value):
+        self._cache.set(key, value)
+
+    async def pop(self, key):
+        self._cache.pop(key)
+
+    async def clear(self):
+        self._cache.clear()
+
+
+class RedisCache:
+    """Общий для нескольких воркеров uvicorn кэш в redis.
+
+    Клиент асинхронный: обращение к кэшу из обработчика не блокирует цикл событий.
+    Значения хранятся в JSON, поэтому кортежи возвращаются списками.
+    """
+
+    def __init__(self, url: str, prefix: str, ttl: float = 300):
+        self.client = aioredis.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, key, default=None):
+        raw = await self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else default
+
+    async def set(self, key, value):
+        await self.client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+
+    async def pop(self, key):
+        await self.client.delete(self.prefix + key)
+
+    async def clear(self):
+        async for key in self.client.scan_iter(self.prefix + '*'):
+            await self.client.delete(key)
+
+
+def make_cache(prefix: str, maxsize: int = 10000, ttl: float = 300):
+    """Общий кэш в redis, если задан CACHE_REDIS_URL и установлен redis, иначе кэш в памяти.
+
+    Методы кэша асинхронные и вызываются через await.
+    """
+    if config.CACHE_REDIS_URL and aioredis is not None:
+        return RedisCache(config.CACHE_REDIS_URL, prefix, ttl)
+    return MemoryCache(maxsize, ttl)